@@ -9,7 +9,7 @@ sys.path.append(str(Path(__file__).parents[1]))  # noqa: E402
 
 import modules
 from common import utils
-from settings import USERDATA_DIR, SAVE_DIR, COURSE_LIST_JSON_PATH, DOWNLOAD_CONTENT_LIST_JSON_PATH, FILE_HISTORY_JSON_PATH, IS_UPDATE_COURSE_LIST
+from settings import USERDATA_DIR, SAVE_DIR, COURSE_LIST_JSON_PATH, DOWNLOAD_CONTENT_LIST_JSON_PATH, FILE_HISTORY_JSON_PATH, IS_UPDATE_COURSE_LIST, IS_RECONCILE_MODE, COURSE_SCOPE, RECORD_ARCHIVE_PATH, RECORD_SCRUB_WORDS, RECORD_SCRUB_SELECTORS, SEARCH_INDEX
 
 if __name__ == "__main__":
 
@@ -20,6 +20,11 @@ if __name__ == "__main__":
             print(f"The directory '{dir}' is not found.")
             sys.exit()
 
+    # ページを記録する場合は、個人情報を取り除く設定が必要
+    if RECORD_ARCHIVE_PATH and not RECORD_SCRUB_WORDS and not RECORD_SCRUB_SELECTORS:
+        print("Set 'record_scrub_words' or 'record_scrub_selectors' in settings.json to record pages.")
+        sys.exit()
+
     # 必要なファイルの作成
     COURSE_LIST_JSON_PATH.touch(exist_ok=True)
     FILE_HISTORY_JSON_PATH.touch(exist_ok=True)
@@ -27,21 +32,44 @@ if __name__ == "__main__":
     # ブラウザ起動
     driver = utils.launch_browser(
         userdata_dir=USERDATA_DIR, download_dir=SAVE_DIR)
+    # 開いたページを記録する場合は、ドライバーを記録用のドライバーで包む
+    if RECORD_ARCHIVE_PATH:
+        driver = modules.RecordingDriver(driver)
 
     # 講義の一覧を更新する
     if IS_UPDATE_COURSE_LIST:
         # manabaのホームページからスクレイピングをして、講義の一覧を取得する
-        course_list = modules.CourseList.from_manaba(driver)
-        # 取得した講義の一覧をJSONファイルに保存する
-        course_list.to_json(COURSE_LIST_JSON_PATH)
+        all_course_list = modules.CourseList.from_manaba(driver)
     else:
         # JSONファイルから講義の一覧を取得する
-        course_list = modules.CourseList.from_json(COURSE_LIST_JSON_PATH)
+        all_course_list = modules.CourseList.from_json(COURSE_LIST_JSON_PATH)
+    # 範囲で絞り込むのはダウンロードする講義だけにする（JSONファイルには範囲外の講義も保存する）
+    course_list = all_course_list.filter(
+        modules.CourseScope.from_dict(COURSE_SCOPE))
+    # ダウンロード中に例外が発生しても更新した講義の一覧が残るように、先に保存しておく
+    all_course_list.to_json(COURSE_LIST_JSON_PATH)
 
-    # ダウンロードするコンテンツの名前の一覧から該当のコンテンツにある未読の添付ファイルをダウンロードする
     download_content_list = modules.DownloadContentList.from_json(
         DOWNLOAD_CONTENT_LIST_JSON_PATH)
-    download_content_list.download_contents(driver, course_list)
+    try:
+        if IS_RECONCILE_MODE:
+            # 該当のコンテンツの全てのページから、手元にない添付ファイルと更新された添付ファイルをダウンロードする
+            download_content_list.reconcile_contents(driver, course_list)
+        else:
+            # ダウンロードするコンテンツの名前の一覧から該当のコンテンツにある未読の添付ファイルをダウンロードする
+            download_content_list.download_contents(driver, course_list)
+    finally:
+        # 講義の一覧をJSONファイルに保存する（コンテンツの一覧は検索された講義の分だけ取得済み、絞り込んだ一覧と講義を共有している）
+        all_course_list.to_json(COURSE_LIST_JSON_PATH)
+
+        # 記録したページをアーカイブに書き込む（途中で例外が発生しても、それまでに記録したページを残す）
+        if RECORD_ARCHIVE_PATH:
+            driver.save(RECORD_ARCHIVE_PATH)
 
     # ブラウザを終了する
     driver.quit()
+
+    # 新しくダウンロードしたファイルを全文検索用の索引に加える（ブラウザの終了後に、複数のプロセスで文字を抽出する）
+    if SEARCH_INDEX["is_enabled"]:
+        modules.SearchIndex().update(
+            modules.FileHistory.from_json(FILE_HISTORY_JSON_PATH))
@@ -1,5 +1,6 @@
 from pathlib import Path
 from contextlib import suppress
+from time import sleep
 
 from selenium import webdriver
 from webdriver_manager.chrome import ChromeDriverManager
@@ -82,3 +83,18 @@ def go_manaba(driver: WebDriver):
     with suppress(NoSuchElementException):
         driver.find_element(By.CSS_SELECTOR, css_selector).click()
         # すでにリスト形式になっている場合は何もせずに次に進む
+
+
+def wait_page_loaded(driver: WebDriver, timeout: int = 30) -> None:
+    """ページが読み込まれるまで待機し、さらに描画が落ち着くまで少し待つ
+
+    Args:
+        driver (WebDriver): ブラウザを操作するドライバー（Selenium）
+        timeout (int, optional): 読み込みを待つ最大時間（秒、デフォルト値は30）
+
+    Note:
+        描画を待つ時間はdriverのpage_settle_seconds属性で変更できる（属性がない場合は1秒、リプレイ時は0秒）
+    """
+
+    WebDriverWait(driver, timeout).until(EC.visibility_of_all_elements_located)
+    sleep(getattr(driver, "page_settle_seconds", 1))
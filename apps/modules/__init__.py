@@ -6,7 +6,15 @@ sys.path.append(str(Path(__file__).parents[2]))  # noqa: E402
 from .content import Content
 from .course_list import CourseList
 from .course import Course
+from .course_scope import CourseScope
 from .download_content_list import DownloadContentList
 from .download_content import DownloadContent
+from .download_pipeline import DownloadPipeline
 from .file_history import FileHistory
 from .file_metadata import FileMetadata
+from .page_prefetcher import PagePrefetcher
+from .reconcile import Reconciler
+from .search_index import SearchIndex, SearchResult
+from .session_archive import SessionArchive, RecordingDriver, ReplayDriver
+from .shard import ShardCoordinator, ShardWorker
+from .work_queue import WorkQueue, WorkItem
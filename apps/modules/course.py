@@ -1,15 +1,14 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
 import re
-from time import sleep
 
 from bs4 import BeautifulSoup
 from selenium.webdriver.chrome.webdriver import WebDriver
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
 
 from .content import Content
-from settings import MANABA_CLIENT_URL
+from common import utils
+from settings import MANABA_CLIENT_URL, PERIOD_TIMES
 
 
 @dataclass(slots=True)
@@ -31,18 +30,22 @@ class Course:
     professor: str
     content_list: list[Content] = field(
         default_factory=list)  # この講義内のコンテンツのリスト
+    is_fetched: bool = False  # content_listを講義ページから取得済みの場合はTrue
 
     # スケジュールの各項目の正規表現
     semester_regex = re.compile(r'(前期|後期|通年)')
     day_regex = re.compile(r'[日月火水木金土]曜')
     period_regex = re.compile(r'[1-5]限')
 
+    days = "月火水木金土日"  # datetime.weekday()の順に並べた曜日
+    lecture_minutes = 90  # 1コマの講義時間（分）
+
     def __post_init__(self):
         self.name.removesuffix(" ")  # 末尾の空白文字を削除（ディレクトリ名に使われるため）
 
         # content_listの各要素が辞書型の場合は、Content型のデータクラスに変換する（CourseList.from_json()で辞書型をデータクラスに変換する際に呼ばれる）
-        self.content_list = [Content(**content)
-                             for content in self.content_list if isinstance(content, dict)]
+        self.content_list = [Content(**content) if isinstance(content, dict) else content
+                             for content in self.content_list]
 
     @classmethod
     def from_soup(cls, course_table_raw_soup: BeautifulSoup) -> Course:
@@ -86,6 +89,33 @@ class Course:
         # 得られた講義の各情報からコースクラスのインスタンスを生成
         return cls(name, full_link, year, semester, day, period, professor)
 
+    def next_lecture_at(self, now: datetime) -> datetime:
+        """引数の日時以降で、この講義の次の開始日時を返す
+
+        Args:
+            now (datetime): 基準日時
+
+        Returns:
+            datetime: 次の講義の開始日時（曜日や時限が不明の場合はNone）
+
+        Note:
+            講義中の場合は、その講義の開始日時を返す
+            各時限の開始時刻は設定ファイルのperiod_timesを使う
+        """
+
+        if self.day == "Unknown" or self.period not in PERIOD_TIMES:
+            return None
+
+        hour, minute = map(int, PERIOD_TIMES[self.period].split(":"))
+        weekday = Course.days.index(self.day[0])
+
+        # 今日の同じ曜日からの日数を求め、講義が終わっている場合は翌週にする
+        start = datetime.combine(
+            now.date() + timedelta(days=(weekday - now.weekday()) % 7), time(hour, minute))
+        if start + timedelta(minutes=Course.lecture_minutes) <= now:
+            start += timedelta(weeks=1)
+        return start
+
     def fetch_content_list(self, driver: WebDriver) -> None:
         """この講義がもつコンテンツの一覧を講義ページから取得して、メンバ変数content_listに格納する
 
@@ -95,8 +125,7 @@ class Course:
 
         # 講義ページに移動
         driver.get(self.link)
-        WebDriverWait(driver, 10).until(EC.visibility_of_all_elements_located)
-        sleep(1)
+        utils.wait_page_loaded(driver, 10)
 
         # 講義ページから各コンテンツのソースを取得
         html = driver.page_source.encode('utf-8')
@@ -112,12 +141,16 @@ class Course:
 
         # コンテンツの一覧を格納する
         self.content_list = content_list
+        self.is_fetched = True
 
-    def search_content(self, name: str) -> Content:
+    def search_content(self, name: str, driver: WebDriver = None) -> Content:
         """メンバ変数のコンテンツの一覧から、引数の名前を含むコンテンツを検索する
 
+        コンテンツの一覧が未取得の場合は、最初の検索時に講義ページから取得する
+
         Args:
             name (str): 検索するコンテンツ名
+            driver (WebDriver, optional): コンテンツの一覧の取得に使うドライバー（デフォルト値はNoneで、取得しない）
 
         Returns:
             Content: 目的のコンテンツ（見つからなかった場合や複数ある場合はNone）
@@ -128,6 +161,10 @@ class Course:
             ex) コンテンツの一覧に'講義資料'と'講義資料前準備'の2つがある場合、'講義資料'で検索したら、'講義資料'のコンテンツを返す
         """
 
+        # コンテンツの一覧が未取得の場合は、講義ページから取得する
+        if not self.is_fetched and driver is not None:
+            self.fetch_content_list(driver)
+
         # 完全一致検索を行う（結果はリスト）
         exact_match_result = list(
             filter(lambda content: name == content.name, self.content_list))
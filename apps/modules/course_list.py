@@ -7,6 +7,7 @@ from bs4 import BeautifulSoup
 from selenium.webdriver.chrome.webdriver import WebDriver
 
 from .course import Course
+from .course_scope import CourseScope
 from common import utils
 
 
@@ -28,14 +29,18 @@ class CourseList:
         self.course_list = course_list
 
     @classmethod
-    def from_manaba(cls, driver: WebDriver) -> CourseList:
+    def from_manaba(cls, driver: WebDriver, scope: CourseScope = None) -> CourseList:
         """manabaのホームページに行き、そのソースから自身のインスタンスを生成する
 
         Args:
             driver (Webdriver): 
+            scope (CourseScope, optional): 取得する講義の範囲（デフォルト値はNoneで、全ての講義を取得する）
 
         Returns:
             CourseList: 講義の一覧を引数とした自身のインスタンス
+
+        Note:
+            各講義のコンテンツの一覧は取得しない（Course.search_contentで最初に検索されたときに取得される）
         """
 
         utils.go_manaba(driver)
@@ -52,13 +57,10 @@ class CourseList:
         del course_raws_soup[0]  # 表のヘッダー部分である先頭要素を削除
 
         # 講義の一覧表のsoupから講義の一覧を生成する
-        course_list = []
-        for course_raw_soup in course_raws_soup:
-            course = Course.from_soup(course_raw_soup)
-            course.fetch_content_list(driver)
-            course_list.append(course)
+        course_list = [Course.from_soup(course_raw_soup)
+                       for course_raw_soup in course_raws_soup]
 
-        return cls(course_list)
+        return cls(course_list).filter(scope)
 
     @classmethod
     def from_json(cls, json_path: Path) -> CourseList:
@@ -68,9 +70,13 @@ class CourseList:
             json_path (Path): 講義の一覧が記載されたJSONファイルパス
 
         Returns:
-            CourseList: 講義の一覧を引数とした自身のインスタンス
+            CourseList: 講義の一覧を引数とした自身のインスタンス（JSONファイルの中身が空の場合は、空の講義の一覧）
         """
 
+        # JSONファイルの中身が空の場合（講義の一覧を一度も保存していない場合）
+        if json_path.stat().st_size == 0:
+            return cls([])
+
         with open(json_path, "r", encoding='utf-8') as f:
             course_dict_list = json.load(f)  # JSONデータを辞書形式で読み取る
 
@@ -98,6 +104,20 @@ class CourseList:
             # JSON形式でファイルに書き込む
             json.dump(course_dict_list, f, ensure_ascii=False)
 
+    def filter(self, scope: CourseScope = None) -> CourseList:
+        """引数の範囲に含まれる講義だけをもつインスタンスを生成する
+
+        Args:
+            scope (CourseScope, optional): 講義の範囲（デフォルト値はNoneで、絞り込みを行わない）
+
+        Returns:
+            CourseList: 絞り込んだ講義の一覧を引数とした自身のインスタンス
+        """
+
+        if scope is None:
+            return self
+        return CourseList([course for course in self.course_list if scope.contains(course)])
+
     def search_course(self, name: str) -> Course:
         """メンバ変数の講義の一覧から、引数の名前を含む講義を検索する（Course.search_contentとアルゴリズムは同じ）
 
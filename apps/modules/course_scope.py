@@ -0,0 +1,92 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import date
+
+from .course import Course
+
+
+@dataclass(frozen=True, slots=True)
+class CourseScope:
+    """スクレイピングする講義の範囲（年度、学期、曜日、時限）を表すデータクラス
+
+    各項目がNoneの場合は、その項目で絞り込みを行わない
+
+    Note:
+        設定ファイルのcourse_scopeから生成されることを想定
+    """
+
+    year: tuple[str, ...] | None = None  # ex) ("2022",)
+    semester: tuple[str, ...] | None = None  # ex) ("前期", "通年")
+    day: tuple[str, ...] | None = None  # ex) ("月曜", "火曜")
+    period: tuple[str, ...] | None = None  # ex) ("1限", "2限")
+
+    @classmethod
+    def from_dict(cls, scope_dict: dict, today: date = None) -> CourseScope:
+        """設定ファイルの辞書から自身のインスタンスを生成する
+
+        Args:
+            scope_dict (dict): 各項目の値（文字列または文字列のリスト）をもつ辞書
+            today (date, optional): "current"を解釈する基準日（デフォルト値はNoneで、今日の日付）
+
+        Returns:
+            CourseScope: 生成した自身のインスタンス
+
+        Note:
+            yearとsemesterには"current"を指定でき、それぞれ今年度と今学期（通年を含む）に置き換えられる
+            ex) {"year": "current", "semester": "current"}
+        """
+
+        today = today or date.today()
+        current_year, current_semester = cls.current_term(today)
+
+        def to_tuple(value, current_value):
+            if value is None:
+                return None
+            values = value if isinstance(value, list) else [value]
+            result = []
+            for v in values:
+                if v == "current":
+                    result.extend(current_value)
+                else:
+                    result.append(str(v))
+            return tuple(result)
+
+        return cls(to_tuple(scope_dict.get("year"), (current_year,)),
+                   to_tuple(scope_dict.get("semester"),
+                            (current_semester, "通年")),
+                   to_tuple(scope_dict.get("day"), ()),
+                   to_tuple(scope_dict.get("period"), ()))
+
+    @staticmethod
+    def current_term(today: date) -> tuple[str, str]:
+        """引数の日付が属する年度と学期を返す
+
+        Args:
+            today (date): 基準日
+
+        Returns:
+            tuple[str, str]: 年度と学期（前期または後期） ex) ("2022", "前期")
+
+        Note:
+            4月〜9月を前期、10月〜翌年3月を後期とする（1月〜3月は前年度の後期）
+        """
+
+        if today.month < 4:
+            return str(today.year - 1), "後期"
+        if today.month < 10:
+            return str(today.year), "前期"
+        return str(today.year), "後期"
+
+    def contains(self, course: Course) -> bool:
+        """引数の講義がこの範囲に含まれるかを返す
+
+        Args:
+            course (Course): 判定する講義
+
+        Returns:
+            bool: 範囲に含まれる場合はTrue
+        """
+
+        items = ((self.year, course.year), (self.semester, course.semester),
+                 (self.day, course.day), (self.period, course.period))
+        return all(values is None or str(value) in values for values, value in items)
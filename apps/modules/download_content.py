@@ -1,17 +1,22 @@
 from __future__ import annotations
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack
 from dataclasses import dataclass
-from time import sleep
+from functools import partial
 
 from bs4 import BeautifulSoup
 from selenium.webdriver.chrome.webdriver import WebDriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
 
+from .content import Content
 from .course_list import CourseList
 from .file_history import FileHistory
 from .file_metadata import FileMetadata
-from settings import FILE_HISTORY_JSON_PATH
+from .page_prefetcher import PagePrefetcher
+from .segmented_download import SegmentedDownloader
+from common import utils
+from settings import FILE_HISTORY_JSON_PATH, IS_BATCH_DOWNLOAD, PIPELINE_CONCURRENCY, PREFETCH_TAB_COUNT, SEGMENTED_DOWNLOAD
 
 
 @dataclass(frozen=True, slots=True)
@@ -24,22 +29,112 @@ class DownloadContent:
     course_name: str
     content_name: str
 
-    def _download_attachments(self, driver: WebDriver, link: str):
-        """引数のリンクにアクセスし、そのページにある添付ファイルをダウンロードする
+    def resolve_content(self, driver: WebDriver, course_list: CourseList) -> Content:
+        """引数の講義の一覧から、ダウンロードするコンテンツを探す
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            course_list (CourseList): 講義の一覧
+
+        Returns:
+            Content: 目的のコンテンツ（見つからなかった場合はNone）
+        """
+
+        course = course_list.search_course(self.course_name)
+        if course is None:
+            return None
+
+        return course.search_content(self.content_name, driver)
+
+    def find_unread_links(self, driver: WebDriver, content: Content) -> list[str]:
+        """引数のコンテンツのページに移動し、コンテンツ内の未読のページのリンクを取得する
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            content (Content): ダウンロードするコンテンツ
+
+        Returns:
+            list[str]: 未読のページのリンクのリスト
+        """
+
+        return self.find_page_links(driver, content, is_unread_only=True)
+
+    def find_page_links(self, driver: WebDriver, content: Content, is_unread_only: bool = False) -> list[str]:
+        """引数のコンテンツのページに移動し、コンテンツ内のページのリンクを取得する
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            content (Content): ダウンロードするコンテンツ
+            is_unread_only (bool, optional): Trueの場合は未読のページだけを取得する（デフォルト値はFalseで、既読のページも含む）
+
+        Returns:
+            list[str]: ページのリンクのリスト
+        """
+
+        # 目的のコンテンツのリンクに移動
+        driver.get(content.link)
+        utils.wait_page_loaded(driver)  # ページが読み込まれるまで待機（最大30秒）
+
+        # ページの一覧から探す（未読のページにはGRIunreadクラスが付いている）
+        page_css_selector = \
+            "#container > div.pagebody > div.contents > div > div > div.articlebody > div.contentbody-right > div > table > tbody > tr:nth-child(2) > td > ul > li"
+        if is_unread_only:
+            page_css_selector += ".GRIunread"
+        page_items = driver.find_elements(
+            By.CSS_SELECTOR, page_css_selector)
+        if page_items == []:
+            print(
+                f"No {'unread ' if is_unread_only else ''}contents in {content.name} of {self.course_name}")
+            return []
+
+        return [item.find_element(By.TAG_NAME, "a").get_attribute("href") for item in page_items]
+
+    def fetch_attachments(self, driver: WebDriver, link: str, prefetcher: PagePrefetcher = None) -> list[FileMetadata]:
+        """引数のリンクにアクセスし、そのページにある添付ファイルのメタデータを取得する
 
         Args:
             driver (Webdriver): ブラウザを操作するドライバー（Selenium）
             link (str): 添付ファイルがあるリンク
+            prefetcher (PagePrefetcher, optional): ページを先読みしているタブ（デフォルト値はNoneで、メインのタブで開く）
+
+        Returns:
+            list[FileMetadata]: 添付ファイルのメタデータのリスト（添付ファイルが無い場合は空リスト）
+        """
+
+        return self.parse_attachments(self.fetch_page_source(driver, link, prefetcher))
+
+    def fetch_page_source(self, driver: WebDriver, link: str, prefetcher: PagePrefetcher = None) -> str:
+        """引数のリンクにアクセスし、そのページのソースを取得する
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            link (str): ページのリンク
+            prefetcher (PagePrefetcher, optional): ページを先読みしているタブ（デフォルト値はNoneで、メインのタブで開く）
+
+        Returns:
+            str: ページのソース
         """
 
+        if prefetcher is not None:
+            return prefetcher.take(link)
+
         driver.get(link)
-        WebDriverWait(driver, 30).until(
-            EC.visibility_of_all_elements_located)  # ページが読み込まれるまで待機（最大30秒）
-        sleep(1)
+        utils.wait_page_loaded(driver)  # ページが読み込まれるまで待機（最大30秒）
+
+        return driver.page_source  # 今開いているhtml
+
+    def parse_attachments(self, html: str) -> list[FileMetadata]:
+        """引数のページのソースから、添付ファイルのメタデータを取得する
 
-        html = driver.page_source.encode("utf-8")  # 今開いているhtmlを取得
+        Args:
+            html (str): 添付ファイルがあるページのソース
+
+        Returns:
+            list[FileMetadata]: 添付ファイルのメタデータのリスト（添付ファイルが無い場合は空リスト）
+        """
 
-        soup = BeautifulSoup(html, "html.parser")  # htmlを「html.parser」で解析する
+        # htmlを「html.parser」で解析する
+        soup = BeautifulSoup(html.encode("utf-8"), "html.parser")
         # course_name = soup.find("a", id="coursename")["title"].strip() # 講義名
         body = soup.find("div", class_="contentbody-left")  # コンテンツの中身
         page_title = body.find("h1", class_="pagetitle").get_text(
@@ -51,23 +146,163 @@ class DownloadContent:
         if attachment_files == []:
             print(
                 f"Attachment was not found in {page_title} of {self.course_name}")
+            return []
+
+        return [FileMetadata.from_soup(f, self.course_name, self.content_name, page_title)
+                for f in attachment_files]
+
+    @staticmethod
+    def _record_downloads(futures: dict[Future, FileMetadata], file_history: FileHistory, is_wait: bool, retry: Callable[[FileMetadata], Future]) -> None:
+        """ダウンロードが完了したファイルのメタデータを履歴に加え、JSONファイルに書き込む
+
+        Args:
+            futures (dict[Future, FileMetadata]): ダウンロードの完了待ちとそのファイルのメタデータ（履歴に加えたものは取り除かれる）
+            file_history (FileHistory): ダウンロードしたファイルの履歴
+            is_wait (bool): Trueの場合は全てのダウンロードの完了を待つ、Falseの場合は完了済みのものだけを履歴に加える
+            retry (Callable[[FileMetadata], Future]): 分割ダウンロードに失敗したファイルを、ブラウザでダウンロードし直す関数
+
+        Note:
+            ブラウザを操作するので、ダウンロードを開始したスレッドから呼び出すこと
+        """
+
+        while futures != {}:
+            finished = [future for future in futures if future.done()]
+            if finished == []:
+                if not is_wait:
+                    return
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                file_metadata = futures.pop(future)
+                # 分割ダウンロードに失敗した場合（Falseが返ってきた場合）は、ブラウザでダウンロードし直す
+                if future.result() is False:
+                    print(f"Retrying '{file_metadata.name}' with the browser")
+                    futures[retry(file_metadata)] = file_metadata
+                    continue
+                file_history.add(file_metadata)
+                file_history.to_json(FILE_HISTORY_JSON_PATH)
+
+    @staticmethod
+    def _wait_for_slot(futures: dict[Future, FileMetadata], file_history: FileHistory, retry: Callable[[FileMetadata], Future]) -> None:
+        """ダウンロード中のファイルが同時にダウンロードする数の上限に達している場合は、どれかが完了するまで待って履歴に加える
+
+        Args:
+            futures (dict[Future, FileMetadata]): ダウンロードの完了待ちとそのファイルのメタデータ（履歴に加えたものは取り除かれる）
+            file_history (FileHistory): ダウンロードしたファイルの履歴
+            retry (Callable[[FileMetadata], Future]): 分割ダウンロードに失敗したファイルを、ブラウザでダウンロードし直す関数
+
+        Note:
+            同時にダウンロードする数はパイプラインのdownloadステージのワーカー数と同じ（ブラウザの同時接続数の制限で待たされ、タイムアウトするのを防ぐ）
+        """
+
+        while len(futures) >= PIPELINE_CONCURRENCY["download"]:
+            wait(futures, return_when=FIRST_COMPLETED)
+            DownloadContent._record_downloads(
+                futures, file_history, is_wait=False, retry=retry)
+
+    @staticmethod
+    def _submit_download(driver: WebDriver, file_metadata: FileMetadata, executor: ThreadPoolExecutor, downloader: SegmentedDownloader = None) -> Future:
+        """添付ファイルのダウンロードを開始し、完了を待つ処理をexecutorに渡す
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            file_metadata (FileMetadata): ダウンロードするファイルのメタデータ
+            executor (ThreadPoolExecutor): 完了を待つ処理を実行するexecutor
+            downloader (SegmentedDownloader, optional): 大きなファイルを分割してダウンロードするダウンローダー（デフォルト値はNoneで、分割しない）
+
+        Returns:
+            Future: ダウンロードの完了待ち（分割ダウンロードの場合は、失敗するとFalseを返す）
+        """
+
+        if downloader is not None and downloader.probe(file_metadata.link) is not None:
+            return executor.submit(file_metadata.download_segmented, downloader)
+
+        staging_dir = file_metadata.start_download(driver, is_staged=True)
+        return executor.submit(file_metadata.wait_download, staging_dir)
+
+    def _download_attachments(self, driver: WebDriver, link: str, downloader: SegmentedDownloader = None):
+        """引数のリンクにアクセスし、そのページにある添付ファイルをダウンロードする
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            link (str): 添付ファイルがあるリンク
+            downloader (SegmentedDownloader, optional): 大きなファイルを分割してダウンロードするダウンローダー（デフォルト値はNoneで、分割しない）
+        """
+
+        self.download_files(driver, self.fetch_attachments(
+            driver, link), downloader)
+
+    def download_files(self, driver: WebDriver, file_metadata_list: list[FileMetadata], downloader: SegmentedDownloader = None) -> None:
+        """引数の添付ファイルをダウンロードし、ファイルの履歴に加える
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            file_metadata_list (list[FileMetadata]): ダウンロードするファイルのメタデータのリスト
+            downloader (SegmentedDownloader, optional): 大きなファイルを分割してダウンロードするダウンローダー（デフォルト値はNoneで、分割しない）
+        """
+
+        if file_metadata_list == []:
             return
 
         # ダウンロードしたファイルの履歴をJSONファイルから生成する
         file_history = FileHistory.from_json(FILE_HISTORY_JSON_PATH)
 
+        if IS_BATCH_DOWNLOAD:
+            # 同時にダウンロードする数の上限まで添付ファイルのダウンロードを開始し、完了したものから順に履歴に加える
+            with ThreadPoolExecutor(max_workers=PIPELINE_CONCURRENCY["download"]) as executor:
+                # 分割ダウンロードに失敗したファイルは、ブラウザでダウンロードし直す
+                retry = partial(self._submit_download, driver, executor=executor)
+                futures = {}
+                for file_metadata in file_metadata_list:
+                    self._wait_for_slot(futures, file_history, retry)
+                    futures[self._submit_download(
+                        driver, file_metadata, executor, downloader)] = file_metadata
+                self._record_downloads(
+                    futures, file_history, is_wait=True, retry=retry)
+            return
+
         # 添付ファイルをダウンロードしてファイルの履歴にそのファイルのメタデータを代入する
-        for f in attachment_files:
-            file_metadata = FileMetadata.from_soup(
-                f, self.course_name, self.content_name, page_title)
-            file_metadata.download_by(driver)
+        for file_metadata in file_metadata_list:
+            # 分割ダウンロードに失敗した場合は、ブラウザでダウンロードし直す
+            if downloader is None or downloader.probe(file_metadata.link) is None \
+                    or not file_metadata.download_segmented(downloader):
+                file_metadata.download_by(driver)
             file_history.add(file_metadata)
 
         # ダウンロードしたファイルが加わった履歴をJSONファイルに書き込む
         file_history.to_json(FILE_HISTORY_JSON_PATH)
 
+    def _download_with_prefetch(self, driver: WebDriver, links: list[str], prefetcher: PagePrefetcher, downloader: SegmentedDownloader = None) -> None:
+        """次のページを別のタブで先読みしながら、各ページにある添付ファイルをダウンロードする
+
+        1つのページの添付ファイルのダウンロードを開始したら、完了を待たずに先読みしたページの解析に進む
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            links (list[str]): 添付ファイルがあるページのリンク
+            prefetcher (PagePrefetcher): ページを先読みするタブ
+            downloader (SegmentedDownloader, optional): 大きなファイルを分割してダウンロードするダウンローダー（デフォルト値はNoneで、分割しない）
+        """
+
+        file_history = FileHistory.from_json(FILE_HISTORY_JSON_PATH)
+        prefetcher.schedule(links)
+
+        with ThreadPoolExecutor(max_workers=PIPELINE_CONCURRENCY["download"]) as executor:
+            # 分割ダウンロードに失敗したファイルは、ブラウザでダウンロードし直す
+            retry = partial(self._submit_download, driver, executor=executor)
+            futures = {}
+            for link in links:
+                for file_metadata in self.fetch_attachments(driver, link, prefetcher):
+                    self._wait_for_slot(futures, file_history, retry)
+                    futures[self._submit_download(
+                        driver, file_metadata, executor, downloader)] = file_metadata
+                self._record_downloads(
+                    futures, file_history, is_wait=False, retry=retry)
+            self._record_downloads(
+                futures, file_history, is_wait=True, retry=retry)
+
     def download_content(self, driver: WebDriver, course_list: CourseList) -> None:
-        """コンテンツ内の未読のページにある添付ファイルをダウンロードする
+        """コンテンツ内の未読のページにある添付ファイルを、ページごとに順番にダウンロードする
 
         引数の講義の一覧から、目的のコンテンツのリンクを探す。
         見つかったらそのリンクに移動し、コンテンツ内の未読のページを探す。
@@ -76,34 +311,31 @@ class DownloadContent:
         Args:
             driver (Webdriver): ブラウザを操作するドライバー（Selenium）
             course_list (CourseList): 講義の一覧
+
+        Note:
+            ページを1つずつ開くため、デバッグ時に使うことを想定（通常はDownloadPipelineを使う）
+            IS_BATCH_DOWNLOADがTrueの場合は、1ページにある添付ファイルを同時にダウンロードする（Falseの場合は1つずつ）
+            PREFETCH_TAB_COUNTが1以上の場合は、次のページを別のタブで先読みしながら、前のページのダウンロードの完了を待たずに進む
         """
 
         # ダウンロードするコンテンツをコースリストから探す
-        course = course_list.search_course(self.course_name)
-        if course is None:
-            return
-
-        content = course.search_content(self.content_name)
+        content = self.resolve_content(driver, course_list)
         if content is None:
             return
 
-        # 目的のコンテンツのリンクに移動
-        driver.get(content.link)
-        WebDriverWait(driver, 30).until(
-            EC.visibility_of_all_elements_located)  # ページが読み込まれるまで待機（最大30秒）
-        sleep(1)
-
-        # 未読のページを探す
-        unread_css_selector = \
-            "#container > div.pagebody > div.contents > div > div > div.articlebody > div.contentbody-right > div > table > tbody > tr:nth-child(2) > td > ul > li.GRIunread"
-        unread_items = driver.find_elements(
-            By.CSS_SELECTOR, unread_css_selector)
-        if unread_items == []:
-            print(f"No unread contents in {content.name} of {course.name}")
-            return
+        links = self.find_unread_links(driver, content)
+        with ExitStack() as stack:
+            # 大きなファイルを分割してダウンロードする場合は、ブラウザのCookieを引き継ぐ
+            downloader = stack.enter_context(SegmentedDownloader.from_driver(
+                driver)) if SEGMENTED_DOWNLOAD["is_enabled"] else None
+
+            if PREFETCH_TAB_COUNT > 0:
+                prefetcher = stack.enter_context(PagePrefetcher(driver))
+                self._download_with_prefetch(
+                    driver, links, prefetcher, downloader)
+                return
 
-        # 未読の各ページに移動し、添付ファイルをダウンロードする
-        unread_links = [item.find_element(
-            By.TAG_NAME, "a").get_attribute("href") for item in unread_items]
-        for link in unread_links:
-            self._download_attachments(driver, link)  # 添付ファイルをダウンロードする
+            # 未読の各ページに移動し、添付ファイルをダウンロードする
+            for link in links:
+                self._download_attachments(
+                    driver, link, downloader)  # 添付ファイルをダウンロードする
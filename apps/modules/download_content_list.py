@@ -1,10 +1,17 @@
 from __future__ import annotations
 from dataclasses import dataclass
+from datetime import datetime
 import json
+import math
 from pathlib import Path
 
 from .course_list import CourseList
+from .course_scope import CourseScope
 from .download_content import DownloadContent
+from .download_pipeline import DownloadPipeline
+from .file_metadata import FileMetadata
+from .reconcile import Reconciler
+from settings import IS_SEQUENTIAL_DOWNLOAD, IS_PRIORITY_MODE
 
 
 @dataclass(frozen=True, slots=True)
@@ -37,12 +44,96 @@ class DownloadContentList:
 
         return cls(content_name_list)
 
-    def download_contents(self, driver, course_list: CourseList):
+    def prioritize(self, course_list: CourseList, now: datetime = None) -> dict[DownloadContent, float]:
+        """各コンテンツの講義が次に始まるまでの秒数を優先度として求める
+
+        Args:
+            course_list (CourseList): 講義の一覧
+            now (datetime, optional): 基準日時（デフォルト値はNoneで、現在の日時）
+
+        Returns:
+            dict[DownloadContent, float]: コンテンツごとの優先度（小さいほど優先、今学期に講義がない場合はinf）
+        """
+
+        now = now or datetime.now()
+        current_scope = CourseScope.from_dict(
+            {"year": "current", "semester": "current"}, now.date())
+
+        priorities = {}
+        for content_name in self.content_name_list:
+            course = course_list.search_course(content_name.course_name)
+            next_lecture_at = None
+            if course is not None and current_scope.contains(course):
+                next_lecture_at = course.next_lecture_at(now)
+            priorities[content_name] = math.inf if next_lecture_at is None else max(
+                0.0, (next_lecture_at - now).total_seconds())
+        return priorities
+
+    def plan(self, driver, course_list: CourseList) -> list[FileMetadata]:
+        """ダウンロードせずに、ダウンロードする予定の添付ファイルのメタデータを取得する
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（SeleniumまたはReplayDriver）
+            course_list (CourseList): 講義の一覧
+
+        Returns:
+            list[FileMetadata]: ダウンロードする予定の添付ファイルのメタデータ（コンテンツの一覧の順）
+        """
+
+        file_metadata_list = []
+        for content_name in self.content_name_list:
+            content = content_name.resolve_content(driver, course_list)
+            if content is None:
+                continue
+            for link in content_name.find_unread_links(driver, content):
+                file_metadata_list.extend(
+                    content_name.fetch_attachments(driver, link))
+        return file_metadata_list
+
+    def download_contents(self, driver, course_list: CourseList, is_sequential: bool = IS_SEQUENTIAL_DOWNLOAD, is_priority_mode: bool = IS_PRIORITY_MODE):
         """メンバ変数のコンテンツの名前から、コンテンツ内の未読ページにある添付ファイルをダウンロードする
 
         Args:
             driver (Webdriver): ブラウザを操作するドライバー（Selenium）
             course_list (CourseList): 講義の一覧
+            is_sequential (bool, optional): Trueの場合はパイプラインを使わずに1つずつ順番にダウンロードする（デバッグ用）
+            is_priority_mode (bool, optional): Trueの場合は次の講義の開始が近いコンテンツから順にダウンロードする
+
+        Note:
+            各講義の最初のファイルが届くまでの時間は、パイプラインを使う場合だけ表示する
         """
-        for content_name in self.content_name_list:
-            content_name.download_content(driver, course_list)
+
+        priorities = self.prioritize(course_list) if is_priority_mode else None
+
+        try:
+            if is_sequential:
+                content_name_list = self.content_name_list
+                if priorities is not None:
+                    content_name_list = sorted(
+                        content_name_list, key=priorities.get)
+                for content_name in content_name_list:
+                    content_name.download_content(driver, course_list)
+                return
+
+            DownloadPipeline(driver, course_list).run(
+                self.content_name_list, priorities)
+        finally:
+            # 同時にダウンロードしたファイルの一時ディレクトリを作成した場所を片付ける
+            FileMetadata.remove_staging_dir()
+
+    def reconcile_contents(self, driver, course_list: CourseList) -> None:
+        """メンバ変数のコンテンツの全てのページから、手元にないファイルとmanabaで更新されたファイルをダウンロードする
+
+        Args:
+            driver (Webdriver): ブラウザを操作するドライバー（Selenium）
+            course_list (CourseList): 講義の一覧
+
+        Note:
+            既読のページに後から追加された添付ファイルも取得できる（詳しくはReconcilerを参照）
+        """
+
+        try:
+            Reconciler(driver, course_list).reconcile(self.content_name_list)
+        finally:
+            # 同時にダウンロードしたファイルの一時ディレクトリを作成した場所を片付ける
+            FileMetadata.remove_staging_dir()
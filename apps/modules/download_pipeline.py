@@ -0,0 +1,225 @@
+from __future__ import annotations
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from datetime import timedelta
+from itertools import count
+import math
+from time import perf_counter
+
+from selenium.webdriver.chrome.webdriver import WebDriver
+
+from .content import Content
+from .course_list import CourseList
+from .download_content import DownloadContent
+from .file_history import FileHistory
+from .file_metadata import FileMetadata
+from .page_prefetcher import PagePrefetcher
+from .segmented_download import SegmentedDownloader
+from settings import FILE_HISTORY_JSON_PATH, PIPELINE_CONCURRENCY, PIPELINE_QUEUE_SIZE, PREFETCH_TAB_COUNT, SEGMENTED_DOWNLOAD
+
+# ステージの入力の終わりを表す番兵
+_DONE = object()
+
+
+@dataclass(order=True, slots=True)
+class _Item:
+    """ステージ間のキューに入れる要素（優先度が小さいほど先に取り出され、同じ優先度の場合は入れた順）"""
+
+    priority: float
+    seq: int
+    payload: object = field(compare=False)
+
+
+class DownloadPipeline:
+    """コンテンツの探索からダウンロードまでを、キューでつないだステージで並行に行うクラス
+
+    各ステージ（resolve → discover → extract → download → record）は上限付きのasyncio.PriorityQueueでつながり、
+    ステージごとに設定された数のワーカーが並行に処理する
+    各要素はコンテンツの優先度を引き継ぐため、講義の開始が近いコンテンツの処理が後から来ても先に取り出される
+
+    Attributes:
+        driver (WebDriver): ブラウザを操作するドライバー（Selenium）
+        course_list (CourseList): 講義の一覧
+        concurrency (dict[str, int]): ステージ名ごとのワーカー数
+        queue_size (int): ステージ間のキューの最大長
+
+    Note:
+        WebDriverはスレッドセーフではないため、ブラウザを操作する処理はロックで1つずつ実行する
+        ダウンロードの完了待ちはブラウザを操作しないので、他のステージと並行に実行される
+        PREFETCH_TAB_COUNTが1以上の場合は、見つかった未読ページを別のタブで先読みしておく
+        SEGMENTED_DOWNLOADが有効な場合は、大きなファイルをブラウザを使わずに分割してダウンロードする
+        いずれかのステージで例外が発生した場合は、全てのステージをキャンセルしてから例外を送出する
+    """
+
+    __slots__ = ("driver", "course_list", "concurrency", "queue_size",
+                 "_driver_lock", "_file_history", "_prefetcher", "_downloader", "_seq", "_started_at", "_first_file_times")
+
+    def __init__(self, driver: WebDriver, course_list: CourseList, concurrency: dict[str, int] = None, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.driver = driver
+        self.course_list = course_list
+        self.concurrency = PIPELINE_CONCURRENCY | (concurrency or {})
+        self.queue_size = queue_size
+        self._driver_lock = None
+        self._file_history = None
+        self._prefetcher = None
+        self._downloader = None
+        self._seq = count()
+        self._started_at = None
+        self._first_file_times = {}
+
+    def run(self, download_content_list: list[DownloadContent], priorities: dict[DownloadContent, float] = None) -> None:
+        """引数のダウンロードするコンテンツの未読ページにある添付ファイルをダウンロードする
+
+        Args:
+            download_content_list (list[DownloadContent]): ダウンロードするコンテンツの一覧
+            priorities (dict[DownloadContent, float], optional): コンテンツごとの優先度（小さいほど優先、デフォルト値はNoneで、一覧の順）
+
+        Note:
+            終了時に、各講義の最初のファイルが届くまでの時間を表示する
+        """
+
+        priorities = priorities or {}
+        # 最初のキューは長さに上限があるので、優先度の順に入れる（後から入れた優先度の高い要素が待たされないようにする）
+        items = sorted(_Item(priorities.get(content_name, 0.0), next(self._seq), content_name)
+                       for content_name in download_content_list)
+        asyncio.run(self._run(items))
+        self._report(priorities)
+
+    async def _run(self, items: list[_Item]) -> None:
+        self._driver_lock = asyncio.Lock()
+        self._file_history = FileHistory.from_json(FILE_HISTORY_JSON_PATH)
+        self._started_at = perf_counter()
+        self._first_file_times = {}
+        self._prefetcher = PagePrefetcher(
+            self.driver) if PREFETCH_TAB_COUNT > 0 else None
+
+        stages = [("resolve", self._resolve), ("discover", self._discover), ("extract", self._extract),
+                  ("download", self._download), ("record", self._record)]
+        queues = [asyncio.PriorityQueue(maxsize=self.queue_size)
+                  for _ in stages]
+
+        tasks = [asyncio.create_task(self._feed(queues[0], items))]
+        for i, (name, handler) in enumerate(stages):
+            out_queue = queues[i + 1] if i + 1 < len(queues) else None
+            tasks.append(asyncio.create_task(self._run_stage(
+                handler, queues[i], out_queue, self.concurrency[name])))
+
+        try:
+            await _gather_or_cancel(tasks)
+        finally:
+            if self._prefetcher is not None:
+                self._prefetcher.close()
+            if self._downloader is not None:
+                self._downloader.close()
+
+    @staticmethod
+    async def _feed(queue: asyncio.Queue, items: list[_Item]) -> None:
+        """最初のステージのキューに要素を入れ、最後に番兵を入れる"""
+
+        for item in items:
+            await queue.put(item)
+        await queue.put(_Item(math.inf, math.inf, _DONE))
+
+    async def _run_stage(self, handler: Callable[[object], Awaitable[list]], in_queue: asyncio.Queue, out_queue: asyncio.Queue, worker_count: int) -> None:
+        """入力キューの要素をworker_count個のワーカーで処理し、結果を出力キューに入れる
+
+        Args:
+            handler (Callable[[object], Awaitable[list]]): 1要素を処理して、次のステージに渡す要素のリストを返すコルーチン関数
+            in_queue (asyncio.Queue): 入力キュー
+            out_queue (asyncio.Queue): 出力キュー（最後のステージの場合はNone）
+            worker_count (int): ワーカー数
+        """
+
+        async def worker():
+            while True:
+                item = await in_queue.get()
+                if item.payload is _DONE:
+                    await in_queue.put(item)  # 他のワーカーにも終わりを伝える
+                    return
+                for result in await handler(item.payload):
+                    await out_queue.put(_Item(item.priority, next(self._seq), result))
+
+        await _gather_or_cancel([asyncio.create_task(worker())
+                                 for _ in range(max(1, worker_count))])
+        if out_queue is not None:
+            await out_queue.put(_Item(math.inf, math.inf, _DONE))
+
+    async def _with_driver(self, func: Callable, *args):
+        """ブラウザを操作する関数をロックを取得した状態で別スレッドで実行する"""
+
+        async with self._driver_lock:
+            return await asyncio.to_thread(func, self.driver, *args)
+
+    async def _resolve(self, download_content: DownloadContent) -> list[tuple[DownloadContent, Content]]:
+        content = await self._with_driver(download_content.resolve_content, self.course_list)
+        if content is None:
+            return []
+        return [(download_content, content)]
+
+    async def _discover(self, item: tuple[DownloadContent, Content]) -> list[tuple[DownloadContent, str]]:
+        download_content, content = item
+        links = await self._with_driver(download_content.find_unread_links, content)
+        if self._prefetcher is not None:
+            await self._with_driver(lambda _: self._prefetcher.schedule(links))
+        return [(download_content, link) for link in links]
+
+    async def _extract(self, item: tuple[DownloadContent, str]) -> list[FileMetadata]:
+        download_content, link = item
+        return await self._with_driver(download_content.fetch_attachments, link, self._prefetcher)
+
+    async def _download(self, file_metadata: FileMetadata) -> list[FileMetadata]:
+        # 大きなファイルはブラウザを使わずに分割してダウンロードする（ブラウザのCookieは最初に1度だけ引き継ぐ）
+        if SEGMENTED_DOWNLOAD["is_enabled"]:
+            if self._downloader is None:
+                async with self._driver_lock:
+                    if self._downloader is None:
+                        self._downloader = await asyncio.to_thread(SegmentedDownloader.from_driver, self.driver)
+            if await asyncio.to_thread(self._downloader.probe, file_metadata.link) is not None:
+                if await asyncio.to_thread(file_metadata.download_segmented, self._downloader):
+                    return [file_metadata]
+                print(f"Retrying '{file_metadata.name}' with the browser")
+
+        # 一時ディレクトリにダウンロードして、同時にダウンロードする同名のファイルと取り違えないようにする
+        staging_dir = await self._with_driver(file_metadata.start_download, True)
+        await asyncio.to_thread(file_metadata.wait_download, staging_dir)
+        return [file_metadata]
+
+    async def _record(self, file_metadata: FileMetadata) -> list:
+        # ダウンロードが終わるたびに履歴をJSONファイルに書き込む（途中で中断しても履歴が残る）
+        self._file_history.add(file_metadata)
+        self._file_history.to_json(FILE_HISTORY_JSON_PATH)
+
+        # 最初のファイルが届くまでの時間は、ダウンロードに成功したファイルだけで計測する
+        if file_metadata.can_download:
+            key = (file_metadata.course_name, file_metadata.content_name)
+            self._first_file_times.setdefault(
+                key, perf_counter() - self._started_at)
+        return []
+
+    def _report(self, priorities: dict[DownloadContent, float]) -> None:
+        """各コンテンツの最初のファイルが届くまでの時間を、優先度が高い順に表示する"""
+
+        for (course_name, content_name), elapsed in sorted(
+                self._first_file_times.items(),
+                key=lambda kv: priorities.get(DownloadContent(*kv[0]), 0.0)):
+            priority = priorities.get(
+                DownloadContent(course_name, content_name))
+            if priority is None or priority == math.inf:
+                next_lecture = ""
+            else:
+                next_lecture = f" (next lecture in {timedelta(seconds=int(priority))})"
+            print(
+                f"First file of {content_name} in {course_name}{next_lecture} arrived after {elapsed:.1f}s")
+
+
+async def _gather_or_cancel(tasks: list[asyncio.Task]) -> None:
+    """全てのタスクの完了を待つ（いずれかで例外が発生した場合は、残りのタスクをキャンセルして例外を送出する）"""
+
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
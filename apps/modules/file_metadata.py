@@ -3,14 +3,28 @@ from dataclasses import dataclass, asdict
 import json
 from pathlib import Path
 import re
-from shutil import move
-from time import sleep
+from shutil import move, rmtree
+from threading import Lock
+from time import monotonic, sleep
 import traceback
+from uuid import uuid4
 
 from bs4 import BeautifulSoup
 from selenium.webdriver.chrome.webdriver import WebDriver
 
-from settings import MANABA_CLIENT_URL, SAVE_DIR
+from .segmented_download import SegmentedDownloader
+from settings import MANABA_CLIENT_URL, SAVE_DIR, DOWNLOAD_TIMEOUT, FILE_HISTORY_JSON_PATH
+
+# 同時にダウンロードするファイルごとの一時ディレクトリを作成する場所
+STAGING_DIR = SAVE_DIR / ".staging"
+# ダウンロード中のファイルの拡張子（Chrome）
+PARTIAL_SUFFIXES = (".crdownload", ".tmp")
+# ダウンロードの完了を確認する間隔（秒）
+POLL_INTERVAL = 0.2
+
+# 保存先のパスごとの、そのファイルのリンク（同じ名前の別のファイルを上書きしないため。最初に使うときに履歴から読み込む）
+_path_owners = None
+_path_owners_lock = Lock()
 
 
 @dataclass(slots=True)
@@ -80,56 +94,178 @@ class FileMetadata:
             driver (WebDriver): ブラウザを操作するドライバー（Selenium）
 
         Note:
-            ファイルのダウンロードに20秒以上かかる場合は、SAVE_DIRに保存されます
+            ファイルのダウンロードにDOWNLOAD_TIMEOUT秒以上かかる場合は、SAVE_DIRに保存されます
+            （一時ディレクトリにダウンロードする場合は、ダウンロード中のファイルが大きくなっている間は待ち続けます。詳しくはwait_downloadを参照）
+        """
+
+        self.start_download(driver)
+        self.wait_download()
+
+    def start_download(self, driver: WebDriver, is_staged: bool = False) -> Path:
+        """引数のdriverを用いて、このファイルのダウンロードを開始する（完了は待たない）
+
+        Args:
+            driver (WebDriver): ブラウザを操作するドライバー（Selenium）
+            is_staged (bool, optional): Trueの場合は、このファイル専用の一時ディレクトリにダウンロードする
+
+        Returns:
+            Path: このファイル専用の一時ディレクトリ（is_stagedがFalseの場合はNone）
+
+        Note:
+            is_stagedがTrueの場合は、同時にダウンロードする他のファイルと名前が重複しても、届いたファイルを取り違えない
+            一時ディレクトリにダウンロードが作成されるまで待ってから、ダウンロード先をSAVE_DIRに戻す
         """
 
         # 講義名のディレクトリを作成する
         course_dir = SAVE_DIR / self.course_name
         course_dir.mkdir(exist_ok=True)
 
-        # ファイルをダウンロードする
-        driver.get(self.link)
+        if not is_staged:
+            # ファイルをダウンロードする
+            driver.get(self.link)
+            return None
 
-        # ダウンロードしたファイルを講義名のディレクトリに移動させる
-        for _ in range(10):
-            # ダウンロードが完了していない可能性があるので、2秒間隔で10回ダウンロードしたファイルの移動を試みる
-            sleep(2)
+        # このファイル専用の一時ディレクトリをダウンロード先にしてから、ファイルをダウンロードする
+        staging_dir = STAGING_DIR / uuid4().hex
+        staging_dir.mkdir(parents=True)
+        _set_download_dir(driver, staging_dir)
+        try:
+            driver.get(self.link)
 
-            # ダウンロードする予定のファイルの拡張子をスクレイピングで取得できなかった場合、ファイル名（拡張子なし）で探す
-            if len(Path(self.name).suffix) == 0:
-                for path in SAVE_DIR.iterdir():
-                    if path.is_file and path.stem == self.name:
-                        self.name = path.name  # 見つかった場合は、ファイル名を更新する
+            # ダウンロードが一時ディレクトリに作成される（.crdownloadを含む）まで待つ
+            deadline = monotonic() + DOWNLOAD_TIMEOUT
+            while not any(staging_dir.iterdir()) and monotonic() < deadline:
+                sleep(POLL_INTERVAL)
+        finally:
+            _set_download_dir(driver, SAVE_DIR)
 
-            src_path = SAVE_DIR / self.name  # ダウンロードしたファイルのパス
-            dest_path = course_dir / self.name  # ダウンロードしたファイルの移動先のパス
+        return staging_dir
 
-            # ダウンロードに成功した場合
-            if src_path.is_file():
-                print(
-                    f"Succeeded to download '{self.name}' in {self.page_title} of {self.course_name}")
-                self.can_download = True
+    def wait_download(self, staging_dir: Path = None) -> None:
+        """start_downloadで開始したダウンロードの完了を待ち、ファイルを講義名のディレクトリに移動させる
 
-                # dest_pathへファイルを移動する
-                try:
-                    move(src_path, dest_path)
-                except:
-                    print(
-                        f"Failed to move '{self.name}' in {self.page_title} of {self.course_name}")
-                    print(traceback.format_exc())
-                    dest_path = src_path
+        Args:
+            staging_dir (Path, optional): start_downloadが返した一時ディレクトリ（デフォルト値はNoneで、SAVE_DIRから探す）
+
+        Note:
+            ブラウザを操作しないので、他のファイルのダウンロードやページの移動と並行して呼び出せる
+            ダウンロード中のファイルが大きくなっている間は待ち続け、最後に大きくなってからDOWNLOAD_TIMEOUT秒以内に完了しない場合は、ダウンロードに失敗したとみなす
+            一時ディレクトリは成否に関わらず削除する（失敗した時点で完了していたファイルはSAVE_DIRに移動させる）
+        """
+
+        course_dir = SAVE_DIR / self.course_name
+
+        # ダウンロードしたファイルを講義名のディレクトリに移動させる
+        deadline = monotonic() + DOWNLOAD_TIMEOUT
+        partial_size = 0  # ダウンロード中のファイルの大きさ（大きくなったら待つ期限を延ばす）
+        try:
+            while monotonic() < deadline:
+                # ダウンロードが完了していない可能性があるので、POLL_INTERVAL秒間隔でダウンロードしたファイルの移動を試みる
+                sleep(POLL_INTERVAL)
+
+                if staging_dir is not None:
+                    # 一時ディレクトリにはこのファイルしかないので、ダウンロード中のファイル以外が見つかれば完了
+                    downloaded = _finished_files(staging_dir)
+                    if downloaded == []:
+                        size = sum(_file_size(path)
+                                   for path in staging_dir.iterdir())
+                        if size > partial_size:
+                            partial_size = size
+                            deadline = monotonic() + DOWNLOAD_TIMEOUT
+                        continue
+                    src_path = downloaded[0]
+                    if len(Path(self.name).suffix) == 0:
+                        self.name = src_path.name  # 拡張子を取得できなかった場合は、ファイル名を更新する
                 else:
+                    # ダウンロードする予定のファイルの拡張子をスクレイピングで取得できなかった場合、ファイル名（拡張子なし）で探す
+                    if len(Path(self.name).suffix) == 0:
+                        for path in SAVE_DIR.iterdir():
+                            if path.is_file and path.stem == self.name:
+                                self.name = path.name  # 見つかった場合は、ファイル名を更新する
+
+                    src_path = SAVE_DIR / self.name  # ダウンロードしたファイルのパス
+
+                # ダウンロードに成功した場合
+                if src_path.is_file():
                     print(
-                        f"Succeeded to move '{self.name}' in {self.page_title} of {self.course_name}")
-                finally:
-                    break
-        # ダウンロードしたはずのファイルが見つからなかった場合
+                        f"Succeeded to download '{self.name}' in {self.page_title} of {self.course_name}")
+                    self.can_download = True
+
+                    # ダウンロードしたファイルの移動先のパス（別のファイルと名前が重なる場合は番号を付ける）
+                    dest_path = _claim_dest_path(course_dir, self.name, self.link)
+
+                    # dest_pathへファイルを移動する
+                    try:
+                        move(src_path, dest_path)
+                    except:
+                        print(
+                            f"Failed to move '{self.name}' in {self.page_title} of {self.course_name}")
+                        print(traceback.format_exc())
+                        # 一時ディレクトリは削除するので、SAVE_DIRに移動させる
+                        dest_path = src_path if staging_dir is None else _move_to_save_dir(
+                            src_path)
+                    else:
+                        print(
+                            f"Succeeded to move '{self.name}' in {self.page_title} of {self.course_name}"
+                            + (f" as '{dest_path.name}'" if dest_path.name != self.name else ""))
+                    finally:
+                        break
+            # ダウンロードしたはずのファイルが見つからなかった場合
+            else:
+                print(
+                    f"Failed to download '{self.name}' in {self.page_title} of {self.course_name}")
+                dest_path = "Unknown"
+                # 期限の直後に完了したファイルは、一時ディレクトリと一緒に削除されないようにSAVE_DIRに移動させる
+                if staging_dir is not None:
+                    for path in _finished_files(staging_dir):
+                        dest_path = _move_to_save_dir(path)
+        finally:
+            if staging_dir is not None:
+                rmtree(staging_dir, ignore_errors=True)
+
+        self.path = str(dest_path)  # パスを更新する
+
+    def download_segmented(self, downloader: SegmentedDownloader) -> bool:
+        """このファイルを複数の区間に分けて並行にダウンロードし、講義名のディレクトリに保存する
+
+        Args:
+            downloader (SegmentedDownloader): ブラウザのCookieを引き継いだダウンローダー
+
+        Returns:
+            bool: ダウンロードに成功した場合はTrue、失敗した場合はFalse（ブラウザでダウンロードし直すこと）
+
+        Note:
+            downloader.probeで分割してダウンロードできることを確かめてから呼び出すこと
+        """
+
+        course_dir = SAVE_DIR / self.course_name
+        course_dir.mkdir(exist_ok=True)
+        dest_path = _claim_dest_path(course_dir, self.name, self.link)
+
+        if downloader.download(self.link, dest_path):
+            print(
+                f"Succeeded to download '{self.name}' in {self.page_title} of {self.course_name}")
+            self.can_download = True
         else:
             print(
-                f"Failed to download '{self.name}' in {self.page_title} of {self.course_name}")
+                f"Failed to download '{self.name}' in {self.page_title} of {self.course_name} in segments")
             dest_path = "Unknown"
 
         self.path = str(dest_path)  # パスを更新する
+        return self.can_download
+
+    @staticmethod
+    def remove_staging_dir() -> None:
+        """一時ディレクトリを作成する場所（STAGING_DIR）が空の場合は削除する
+
+        Note:
+            全てのダウンロードが終わってから呼び出すこと（各ファイルの一時ディレクトリは、ダウンロードを待ち終えた時点で削除される）
+        """
+
+        try:
+            STAGING_DIR.rmdir()
+        except OSError:
+            pass  # STAGING_DIRがない場合と、削除できなかった一時ディレクトリが残っている場合は何もしない
 
     def to_json(self, json_path: Path) -> None:
         """ファイルのメタデータをJSONファイルに書き込む（追記）
@@ -144,3 +280,98 @@ class FileMetadata:
         with open(json_path, "a", encoding="utf-8") as f:
             # JSON形式でファイルに追記する
             json.dump(file_dict, f, ensure_ascii=False)
+
+
+def _claim_dest_path(course_dir: Path, name: str, link: str) -> Path:
+    """講義名のディレクトリで、別のリンクのファイルと名前が重ならない保存先のパスを決めて確保する
+
+    Args:
+        course_dir (Path): 講義名のディレクトリ
+        name (str): ファイル名
+        link (str): ファイルのリンク
+
+    Returns:
+        Path: 保存先のファイルパス（別のリンクのファイルが既にある場合は「名前 (1).拡張子」のように番号を付ける）
+
+    Note:
+        同じリンクのファイル（更新されたファイル）と、履歴にないファイルは上書きする
+        この実行中に確保したパスは、ファイルの移動が終わる前でも別のリンクには使わせない
+    """
+
+    global _path_owners
+    with _path_owners_lock:
+        if _path_owners is None:
+            _path_owners = _load_path_owners()
+
+        dest_path = course_dir / name
+        number = 1
+        while _path_owners.get(str(dest_path), link) != link:
+            dest_path = course_dir / \
+                f"{Path(name).stem} ({number}){Path(name).suffix}"
+            number += 1
+        _path_owners[str(dest_path)] = link
+        return dest_path
+
+
+def _load_path_owners() -> dict[str, str]:
+    """ファイルの履歴から、ディスクに残っているファイルのパスごとのリンクを読み込む（新しい履歴を優先）"""
+
+    if not FILE_HISTORY_JSON_PATH.is_file() or FILE_HISTORY_JSON_PATH.stat().st_size == 0:
+        return {}
+    try:
+        with open(FILE_HISTORY_JSON_PATH, "r", encoding="utf-8") as f:
+            file_metadata_dict_list = json.load(f)
+    except (OSError, ValueError):
+        print(f"Failed to read {FILE_HISTORY_JSON_PATH}")
+        return {}
+
+    path_owners = {}
+    for file_dict in file_metadata_dict_list:
+        if file_dict["can_download"] and Path(file_dict["path"]).is_file():
+            path_owners.setdefault(file_dict["path"], file_dict["link"])
+    return path_owners
+
+
+def _set_download_dir(driver: WebDriver, download_dir: Path) -> None:
+    """ブラウザ全体のダウンロード先のディレクトリを変更する（Chrome DevTools Protocolを使う）
+
+    Args:
+        driver (WebDriver): ブラウザを操作するドライバー（Selenium）
+        download_dir (Path): ダウンロード先のディレクトリ
+    """
+
+    driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+        "behavior": "allow", "downloadPath": str(download_dir)})
+
+
+def _finished_files(staging_dir: Path) -> list[Path]:
+    """一時ディレクトリにある、ダウンロードが完了したファイルを返す"""
+
+    return [path for path in staging_dir.iterdir()
+            if path.is_file() and path.suffix not in PARTIAL_SUFFIXES]
+
+
+def _file_size(path: Path) -> int:
+    """ファイルの大きさを返す（ダウンロードの完了で名前が変わり、見つからない場合は0）"""
+
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _move_to_save_dir(src_path: Path) -> Path | str:
+    """一時ディレクトリにあるファイルをSAVE_DIRに移動させる
+
+    Returns:
+        Path | str: 移動先のファイルパス（移動に失敗した場合はUnknown）
+    """
+
+    dest_path = SAVE_DIR / src_path.name
+    try:
+        move(src_path, dest_path)
+    except:
+        print(f"Failed to move '{src_path.name}' to {SAVE_DIR}")
+        print(traceback.format_exc())
+        return "Unknown"
+    return dest_path
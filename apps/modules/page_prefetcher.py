@@ -0,0 +1,121 @@
+from __future__ import annotations
+from collections import deque
+
+from selenium.webdriver.chrome.webdriver import WebDriver
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from settings import PREFETCH_TAB_COUNT
+
+# 同時に開くタブ数の上限（メモリの使用量を抑えるため）
+MAX_PREFETCH_TABS = 4
+
+
+class PagePrefetcher:
+    """これから開くページを別のタブで先読みするクラス
+
+    メインのタブでファイルをダウンロードしている間に、次のページを別のタブで読み込んでおく
+
+    Attributes:
+        driver (WebDriver): ブラウザを操作するドライバー（Selenium）
+        max_tabs (int): 先読みに使うタブ数（0の場合は先読みしない）
+
+    Note:
+        全てのタブは同じブラウザ（ログイン済みのセッション）で開かれる
+        withブロックを抜けると、先読みしたまま使われなかったタブを閉じる
+    """
+
+    __slots__ = ("driver", "max_tabs", "_main_handle", "_tabs", "_pending")
+
+    def __init__(self, driver: WebDriver, max_tabs: int = PREFETCH_TAB_COUNT):
+        self.driver = driver
+        self.max_tabs = min(max(0, max_tabs), MAX_PREFETCH_TABS)
+        self._main_handle = None
+        self._tabs = {}  # 先読み中のページのリンクとタブのハンドル
+        self._pending = deque()  # タブが空くのを待っているリンク
+
+    def __enter__(self) -> PagePrefetcher:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def schedule(self, links: list[str]) -> None:
+        """引数のリンクを先読みする（空いているタブがない場合は、タブが空くまで待たせる）
+
+        Args:
+            links (list[str]): これから開くページのリンク
+        """
+
+        self._pending.extend(links)
+        self._fill()
+
+    def take(self, link: str) -> str:
+        """引数のリンクのページのソースを取得する
+
+        Args:
+            link (str): ページのリンク
+
+        Returns:
+            str: ページのソース
+
+        Note:
+            先読みしていないリンクの場合は、メインのタブで開く
+        """
+
+        handle = self._tabs.pop(link, None)
+        if handle is None:
+            # 先読みされていない場合は、待たせているリンクから外してメインのタブで開く
+            if link in self._pending:
+                self._pending.remove(link)
+            self.driver.get(link)
+            WebDriverWait(self.driver, 30).until(
+                EC.visibility_of_all_elements_located)  # ページが読み込まれるまで待機（最大30秒）
+            html = self.driver.page_source
+        else:
+            # 先読みしたタブに切り替え、読み込みが終わるまで待ってからソースを取得し、タブを閉じる
+            self.driver.switch_to.window(handle)
+            WebDriverWait(self.driver, 30).until(
+                lambda driver: driver.execute_script("return document.readyState") == "complete")
+            html = self.driver.page_source
+            self.driver.close()
+            self.driver.switch_to.window(self._main_handle)
+
+        self._fill()
+        return html
+
+    def close(self) -> None:
+        """先読みしたまま使われなかったタブを閉じて、メインのタブに戻る
+
+        Note:
+            使われなかったタブのリンクを表示する（先読みのリンクとページのリンクが一致していない可能性がある）
+        """
+
+        self._pending.clear()
+        for link, handle in self._tabs.items():
+            print(f"Closed an unused prefetched tab: {link}")
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self._tabs.clear()
+        if self._main_handle is not None:
+            self.driver.switch_to.window(self._main_handle)
+
+    def _fill(self) -> None:
+        """空いているタブの数だけ、待たせているリンクを新しいタブで開く"""
+
+        while self._pending and len(self._tabs) < self.max_tabs:
+            link = self._pending.popleft()
+            if link in self._tabs:
+                continue
+
+            # window.openはページの読み込みを待たないので、読み込みはダウンロードと並行して進む
+            if self._main_handle is None:
+                self._main_handle = self.driver.current_window_handle
+            handles = set(self.driver.window_handles)
+            self.driver.execute_script(
+                "window.open(arguments[0], '_blank');", link)
+            new_handles = set(self.driver.window_handles) - handles
+            if len(new_handles) != 1:
+                print(f"Failed to open a tab for {link}")
+                continue
+            self._tabs[link] = new_handles.pop()
@@ -0,0 +1,193 @@
+from __future__ import annotations
+from contextlib import ExitStack
+from dataclasses import asdict
+from datetime import datetime
+import json
+from pathlib import Path
+
+from selenium.webdriver.chrome.webdriver import WebDriver
+
+from .content import Content
+from .course_list import CourseList
+from .download_content import DownloadContent
+from .file_history import FileHistory
+from .file_metadata import FileMetadata
+from .segmented_download import SegmentedDownloader
+from settings import SAVE_DIR, FILE_HISTORY_JSON_PATH, RECONCILE_INDEX_JSON_PATH, SEGMENTED_DOWNLOAD
+
+
+class Reconciler:
+    """コンテンツの全てのページの添付ファイルと、手元にあるファイルを突き合わせてダウンロードするクラス
+
+    未読のページだけでなく既読のページも開き、manabaにある添付ファイルの索引を作成する。
+    索引と手元のファイル（ファイルの履歴とディスク）を比べ、手元にないファイルとmanabaで更新されたファイルだけをダウンロードする
+
+    Attributes:
+        driver (WebDriver): ブラウザを操作するドライバー（Selenium）
+        course_list (CourseList): 講義の一覧
+        index_path (Path): manabaにある添付ファイルの索引のJSONファイルパス
+        index (dict): コンテンツのリンクごとの、コンテンツの更新日時と各ページの添付ファイル
+
+    Note:
+        ページを開くかどうかはコンテンツごとに判断する（ページを開かずに、そのページの添付ファイルが変わったかは分からないため）
+        前回からコンテンツの更新日時が変わっていない場合は、そのコンテンツのページを開かずに、索引の添付ファイルと手元のファイルを比べる
+        索引のJSONファイルを削除すると、次回は全てのページを開き直す
+    """
+
+    __slots__ = ("driver", "course_list", "index_path", "index", "_refreshed")
+
+    def __init__(self, driver: WebDriver, course_list: CourseList, index_path: Path = RECONCILE_INDEX_JSON_PATH):
+        self.driver = driver
+        self.course_list = course_list
+        self.index_path = index_path
+        self.index = {}
+        if index_path.is_file() and index_path.stat().st_size > 0:
+            with open(index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        self._refreshed = set()  # この実行中にコンテンツの一覧を取得し直した講義のリンク
+
+    def reconcile(self, download_content_list: list[DownloadContent]) -> None:
+        """引数の各コンテンツについて、手元にないファイルと更新されたファイルをダウンロードする
+
+        Args:
+            download_content_list (list[DownloadContent]): ダウンロードするコンテンツの名前の一覧
+        """
+
+        with ExitStack() as stack:
+            # 大きなファイルを分割してダウンロードする場合は、ブラウザのCookieを引き継ぐ
+            downloader = stack.enter_context(SegmentedDownloader.from_driver(
+                self.driver)) if SEGMENTED_DOWNLOAD["is_enabled"] else None
+
+            for download_content in download_content_list:
+                self.reconcile_content(download_content, downloader)
+
+    def reconcile_content(self, download_content: DownloadContent, downloader: SegmentedDownloader = None) -> list[FileMetadata]:
+        """1つのコンテンツについて、manabaの添付ファイルと手元のファイルを突き合わせてダウンロードする
+
+        Args:
+            download_content (DownloadContent): ダウンロードするコンテンツの名前
+            downloader (SegmentedDownloader, optional): 大きなファイルを分割してダウンロードするダウンローダー（デフォルト値はNoneで、分割しない）
+
+        Returns:
+            list[FileMetadata]: ダウンロードを試みたファイルのメタデータのリスト
+        """
+
+        content = self._resolve_content(download_content)
+        if content is None:
+            return []
+
+        local_index = self._build_local_index(
+            FileHistory.from_json(FILE_HISTORY_JSON_PATH))
+
+        stored = self.index.get(content.link)
+        is_unchanged = stored is not None and stored["update_date"] == content.update_date
+        if is_unchanged:
+            # コンテンツが更新されていない場合は、ページを開かずに索引の添付ファイルと比べる
+            pages = stored["pages"]
+        else:
+            pages = self._walk_pages(download_content, content)
+
+        # ページごとに、手元にないファイルと更新されたファイルをダウンロードする
+        targets = []
+        for attachments in pages.values():
+            # 前のページでダウンロードしたファイルが加わった履歴を読み直す
+            file_history = FileHistory.from_json(FILE_HISTORY_JSON_PATH)
+            page_targets = self._diff([FileMetadata(**attachment) for attachment in attachments],
+                                      local_index, file_history)
+            download_content.download_files(
+                self.driver, page_targets, downloader)
+            targets.extend(page_targets)
+
+        print(f"Reconciled {content.name} of {download_content.course_name}: "
+              f"{len(pages)} pages ({'unchanged' if is_unchanged else 'walked'}), "
+              f"{sum(len(attachments) for attachments in pages.values())} attachments, {len(targets)} downloaded")
+
+        # ダウンロードが終わってから索引を更新する（途中で停止した場合は、次回もページを開き直す）
+        self.index[content.link] = {"course_name": download_content.course_name,
+                                    "content_name": download_content.content_name,
+                                    "update_date": content.update_date,
+                                    "pages": pages}
+        self.to_json()
+        return targets
+
+    def to_json(self) -> None:
+        """manabaにある添付ファイルの索引をJSONファイルに書き込む（上書き）"""
+
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+
+    def _resolve_content(self, download_content: DownloadContent) -> Content:
+        """コンテンツの一覧を講義ページから取得し直して、目的のコンテンツを探す（コンテンツの更新日時を最新にするため）"""
+
+        course = self.course_list.search_course(download_content.course_name)
+        if course is None:
+            return None
+
+        if course.link not in self._refreshed:
+            course.fetch_content_list(self.driver)
+            self._refreshed.add(course.link)
+        return course.search_content(download_content.content_name)
+
+    def _walk_pages(self, download_content: DownloadContent, content: Content) -> dict[str, list[dict]]:
+        """コンテンツの全てのページ（既読のページを含む）を開き、各ページの添付ファイルを取得する
+
+        Returns:
+            dict[str, list[dict]]: ページのリンクごとの添付ファイルのメタデータ（辞書型）
+        """
+
+        return {link: [asdict(file_metadata) for file_metadata in download_content.fetch_attachments(self.driver, link)]
+                for link in download_content.find_page_links(self.driver, content)}
+
+    @staticmethod
+    def _build_local_index(file_history: FileHistory) -> dict[str, FileMetadata]:
+        """ファイルの履歴から、ダウンロードに成功してディスクに残っているファイルをリンクごとにまとめる（新しい履歴を優先）"""
+
+        local_index = {}
+        for file_metadata in file_history.file_history:
+            if file_metadata.link in local_index or not file_metadata.can_download:
+                continue
+            if Path(file_metadata.path).is_file():
+                local_index[file_metadata.link] = file_metadata
+        return local_index
+
+    @staticmethod
+    def _diff(upstream: list[FileMetadata], local_index: dict[str, FileMetadata], file_history: FileHistory) -> list[FileMetadata]:
+        """manabaの添付ファイルのうち、手元にないファイルと手元より新しいファイルを返す
+
+        Note:
+            履歴にないが講義名のディレクトリに同じ名前のファイルがある場合は、アップロード日時より後に保存されていれば手元にあるとみなし、履歴に加える
+        """
+
+        targets = []
+        is_adopted = False
+        for file_metadata in upstream:
+            local = local_index.get(file_metadata.link)
+            if local is not None:
+                if _is_newer(file_metadata.upload_date, local.upload_date):
+                    targets.append(file_metadata)
+                continue
+
+            path = SAVE_DIR / file_metadata.course_name / file_metadata.name
+            if path.is_file():
+                saved_date = datetime.fromtimestamp(
+                    path.stat().st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+                if not _is_newer(file_metadata.upload_date, saved_date):
+                    file_metadata.path = str(path)
+                    file_metadata.can_download = True
+                    file_history.add(file_metadata)
+                    local_index[file_metadata.link] = file_metadata
+                    is_adopted = True
+                    continue
+            targets.append(file_metadata)
+
+        if is_adopted:
+            file_history.to_json(FILE_HISTORY_JSON_PATH)
+        return targets
+
+
+def _is_newer(upload_date: str, local_date: str) -> bool:
+    """manabaのアップロード日時が手元の日時より新しい場合はTrueを返す（どちらかが不明の場合はFalse）"""
+
+    if "Unknown" in (upload_date, local_date):
+        return False
+    return upload_date > local_date
@@ -0,0 +1,337 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass
+import hashlib
+from pathlib import Path
+import re
+import sqlite3
+import traceback
+from xml.etree import ElementTree
+import zipfile
+
+from .file_history import FileHistory
+from settings import SEARCH_INDEX, SEARCH_INDEX_PATH
+
+# PDFからの文字の抽出はpypdfがインストールされている場合のみ行う（ない場合はファイル名だけを索引に加える）
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# ファイルのハッシュ値を求めるときに1回で読み込むバイト数
+CHUNK_SIZE = 1024 * 1024
+# trigramで検索できる語の最小の文字数（これより短い語は全文を走査して検索する）
+TRIGRAM_LENGTH = 3
+# 検索結果の抜粋で、一致した語の前後に表示する文字数
+SNIPPET_CHARS = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    course_name TEXT NOT NULL,
+    content_name TEXT NOT NULL,
+    page_title TEXT NOT NULL,
+    upload_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_course ON documents (course_name, upload_date);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5 (name, body, tokenize = 'trigram');
+"""
+
+# OOXML（docx、pptx、xlsx）で文字が入る要素と、段落を表す要素のタグ名（名前空間を除く）
+_TEXT_TAGS = {"t"}
+_PARAGRAPH_TAGS = {"p", "si"}
+
+
+@dataclass(frozen=True, slots=True)
+class SearchResult:
+    """全文検索で見つかった1つのファイルを表すデータクラス"""
+
+    name: str
+    path: str  # 同じ中身のファイルが複数ある場合はそのうちの1つ
+    course_name: str
+    content_name: str
+    page_title: str
+    upload_date: str  # ex) 2000-01-01 00:00:00（不明の場合はUnknown）
+    snippet: str  # 一致した箇所の前後の文字列（一致した語を[]で囲む）
+
+
+class SearchIndex:
+    """ダウンロードしたファイルの中身の全文検索用の索引（SQLiteのFTS5）を扱うクラス
+
+    ファイルの履歴にあるファイルから文字を抽出して索引に加え、講義名、ページタイトル、アップロード日時で絞り込んで検索する
+
+    Attributes:
+        db_path (Path): 索引のファイルパス
+        max_workers (int): 文字を抽出するプロセス数（Noneの場合はCPUの数）
+
+    Note:
+        ファイルの中身のハッシュ値を索引のキーにするので、同じファイルを複数回ダウンロードしても抽出は1回だけ行う
+        サイズと更新日時が前回から変わっていないファイルは、ハッシュ値も求めずに読み飛ばす
+        文字を抽出できる形式はtxt、csv、md、docx、pptx、xlsx、pdf（pypdfが必要）で、それ以外はファイル名だけを索引に加える
+    """
+
+    __slots__ = ("db_path", "max_workers")
+
+    def __init__(self, db_path: Path = SEARCH_INDEX_PATH, max_workers: int = SEARCH_INDEX["max_workers"]):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        with closing(self._connect()) as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def update(self, file_history: FileHistory) -> int:
+        """ファイルの履歴にあるファイルのうち、索引にないものから文字を抽出して索引に加える
+
+        Args:
+            file_history (FileHistory): ダウンロードしたファイルの履歴
+
+        Returns:
+            int: 新しく索引に加えたファイルの数
+
+        Note:
+            削除されたファイルは索引から取り除く
+        """
+
+        with closing(self._connect()) as connection, connection:
+            known_files = {path: (size, mtime) for path, size, mtime in connection.execute(
+                "SELECT path, size, mtime FROM files")}
+            known_hashes = {file_hash for (file_hash,) in connection.execute(
+                "SELECT hash FROM documents")}
+
+            # 履歴の新しい順に、サイズか更新日時が変わったファイルのハッシュ値を求める
+            new_documents = {}  # ハッシュ値とそのファイルのメタデータ
+            seen_paths = set()
+            for file_metadata in file_history.file_history:
+                path = Path(file_metadata.path)
+                if not file_metadata.can_download or str(path) in seen_paths or not path.is_file():
+                    continue
+                seen_paths.add(str(path))
+                stat = path.stat()
+                if known_files.get(str(path)) == (stat.st_size, stat.st_mtime):
+                    continue
+
+                file_hash = _hash_file(path)
+                connection.execute("INSERT OR REPLACE INTO files (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                                   (str(path), stat.st_size, stat.st_mtime, file_hash))
+                if file_hash not in known_hashes and file_hash not in new_documents:
+                    new_documents[file_hash] = file_metadata
+
+            # 削除されたファイルと、どのファイルからも参照されなくなった文書を取り除く
+            for path in known_files.keys() - seen_paths:
+                if not Path(path).is_file():
+                    connection.execute(
+                        "DELETE FROM files WHERE path = ?", (path,))
+            connection.execute(
+                "DELETE FROM documents_fts WHERE rowid IN "
+                "(SELECT id FROM documents WHERE hash NOT IN (SELECT hash FROM files))")
+            connection.execute(
+                "DELETE FROM documents WHERE hash NOT IN (SELECT hash FROM files)")
+
+            if new_documents == {}:
+                return 0
+
+            # 文字の抽出は時間がかかるので、複数のプロセスで並行に行う
+            hashes = list(new_documents)
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                bodies = executor.map(extract_text, [
+                                      new_documents[file_hash].path for file_hash in hashes], chunksize=4)
+                for file_hash, body in zip(hashes, bodies):
+                    file_metadata = new_documents[file_hash]
+                    cursor = connection.execute(
+                        "INSERT INTO documents (hash, name, course_name, content_name, page_title, upload_date) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (file_hash, file_metadata.name, file_metadata.course_name, file_metadata.content_name,
+                         file_metadata.page_title, file_metadata.upload_date))
+                    connection.execute("INSERT INTO documents_fts (rowid, name, body) VALUES (?, ?, ?)",
+                                       (cursor.lastrowid, file_metadata.name, body))
+
+        print(f"Indexed {len(new_documents)} files for search")
+        return len(new_documents)
+
+    def search(self, query: str, course_name: str = None, page_title: str = None, since: str = None, until: str = None, limit: int = 20) -> list[SearchResult]:
+        """索引からファイル名か中身に、引数の語を全て含むファイルを検索する
+
+        Args:
+            query (str): 検索する語（空白で区切ると、全ての語を含むファイルを検索する）
+            course_name (str, optional): 講義名に含まれる文字列で絞り込む
+            page_title (str, optional): ページタイトルに含まれる文字列で絞り込む
+            since (str, optional): この日付以降にアップロードされたファイルに絞り込む（ex: 2000-01-01）
+            until (str, optional): この日付以前にアップロードされたファイルに絞り込む（ex: 2000-12-31）
+            limit (int, optional): 検索結果の最大数
+
+        Returns:
+            list[SearchResult]: 検索結果（3文字以上の語を含む場合は関連度順、それ以外はアップロード日時の新しい順）
+
+        Note:
+            3文字以上の語はtrigramの索引で検索し、2文字以下の語は全文を走査して検索する
+        """
+
+        terms = query.split()
+        conditions, params = self._conditions(
+            terms, course_name, page_title, since, until)
+        is_ranked = any(len(term) >= TRIGRAM_LENGTH for term in terms)
+        order = "bm25(documents_fts)" if is_ranked else "documents.upload_date DESC"
+        sql = ("SELECT documents.name, (SELECT MIN(path) FROM files WHERE files.hash = documents.hash), "
+               "documents.course_name, documents.content_name, documents.page_title, documents.upload_date, documents_fts.body "
+               "FROM documents_fts JOIN documents ON documents.id = documents_fts.rowid "
+               f"WHERE {conditions} ORDER BY {order} LIMIT ?")
+
+        with closing(self._connect()) as connection:
+            rows = connection.execute(sql, params + [limit]).fetchall()
+
+        return [SearchResult(*row[:6], _snippet(row[6], terms)) for row in rows]
+
+    def facets(self, query: str = "", course_name: str = None, page_title: str = None, since: str = None, until: str = None) -> dict[str, int]:
+        """検索で見つかる全てのファイルについて、講義ごとのファイルの数を返す
+
+        Args:
+            query (str, optional): 検索する語（デフォルト値は空文字で、全てのファイル）
+            course_name (str, optional): 講義名に含まれる文字列で絞り込む
+            page_title (str, optional): ページタイトルに含まれる文字列で絞り込む
+            since (str, optional): この日付以降にアップロードされたファイルに絞り込む（ex: 2000-01-01）
+            until (str, optional): この日付以前にアップロードされたファイルに絞り込む（ex: 2000-12-31）
+
+        Returns:
+            dict[str, int]: 講義名とファイルの数（ファイルの数が多い順）
+        """
+
+        conditions, params = self._conditions(
+            query.split(), course_name, page_title, since, until)
+        with closing(self._connect()) as connection:
+            return dict(connection.execute(
+                "SELECT documents.course_name, COUNT(*) "
+                "FROM documents_fts JOIN documents ON documents.id = documents_fts.rowid "
+                f"WHERE {conditions} GROUP BY documents.course_name ORDER BY COUNT(*) DESC", params).fetchall())
+
+    @staticmethod
+    def _conditions(terms: list[str], course_name: str, page_title: str, since: str, until: str) -> tuple[str, list]:
+        """検索する語と、講義名、ページタイトル、アップロード日時で絞り込むSQLの条件とその値を返す"""
+
+        conditions, params = [], []
+
+        # 3文字以上の語はフレーズとしてtrigramの索引で検索する（"は""に置き換える）
+        long_terms = [term for term in terms if len(term) >= TRIGRAM_LENGTH]
+        if long_terms:
+            conditions.append("documents_fts MATCH ?")
+            params.append(" AND ".join(
+                '"' + term.replace('"', '""') + '"' for term in long_terms))
+        # 2文字以下の語は索引を使えないので、全文を走査する
+        for term in terms:
+            if len(term) < TRIGRAM_LENGTH:
+                conditions.append(
+                    "(instr(documents_fts.name, ?) > 0 OR instr(documents_fts.body, ?) > 0)")
+                params.extend([term, term])
+
+        if course_name:
+            conditions.append("instr(documents.course_name, ?) > 0")
+            params.append(course_name)
+        if page_title:
+            conditions.append("instr(documents.page_title, ?) > 0")
+            params.append(page_title)
+        # アップロード日時が不明（Unknown）のファイルは、日付で絞り込むと除かれる
+        if since:
+            conditions.append(
+                "documents.upload_date >= ? AND documents.upload_date != 'Unknown'")
+            params.append(since)
+        if until:
+            conditions.append(
+                "documents.upload_date <= ? AND documents.upload_date != 'Unknown'")
+            params.append(until + " 99")  # 指定した日の全ての時刻を含める（時刻の先頭の数字より大きい）
+        return " AND ".join(conditions) or "1", params
+
+
+def extract_text(path: str) -> str:
+    """ファイルの形式に応じて、ファイルの中身の文字列を抽出する
+
+    Args:
+        path (str): ファイルパス
+
+    Returns:
+        str: 抽出した文字列（対応していない形式や、抽出に失敗した場合は空文字）
+
+    Note:
+        ProcessPoolExecutorで別のプロセスから呼び出すため、モジュールの関数にしている
+    """
+
+    path = Path(path)
+    suffix = path.suffix.lower()
+    try:
+        match suffix:
+            case ".txt" | ".csv" | ".md":
+                data = path.read_bytes()
+                try:
+                    return data.decode("utf-8")
+                except UnicodeDecodeError:
+                    return data.decode("cp932", errors="replace")  # Windowsで作成されたファイル
+            case ".docx":
+                return _extract_ooxml(path, r'word/document\.xml')
+            case ".pptx":
+                return _extract_ooxml(path, r'ppt/slides/slide(\d+)\.xml')
+            case ".xlsx":
+                return _extract_ooxml(path, r'xl/sharedStrings\.xml')
+            case ".pdf" if PdfReader is not None:
+                return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+            case _:
+                return ""
+    except Exception:
+        print(f"Failed to extract text from '{path.name}'")
+        print(traceback.format_exc())
+        return ""
+
+
+def _extract_ooxml(path: Path, member_pattern: str) -> str:
+    """OOXML（zip）のうち、引数の正規表現に一致するXMLから文字列を抽出する（番号がある場合は番号順）"""
+
+    with zipfile.ZipFile(path) as zip_file:
+        members = [(m, name) for name in zip_file.namelist()
+                   if (m := re.fullmatch(member_pattern, name))]
+        members.sort(key=lambda member: int(
+            member[0].group(1)) if member[0].groups() else 0)
+
+        lines = []
+        for _, name in members:
+            root = ElementTree.fromstring(zip_file.read(name))
+            for element in root.iter():
+                if element.tag.rpartition("}")[2] not in _PARAGRAPH_TAGS:
+                    continue
+                line = "".join(t.text for t in element.iter()
+                               if t.tag.rpartition("}")[2] in _TEXT_TAGS and t.text)
+                if line:
+                    lines.append(line)
+    return "\n".join(lines)
+
+
+def _hash_file(path: Path) -> str:
+    """ファイルの中身のハッシュ値（SHA-256）を求める"""
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _snippet(body: str, terms: list[str]) -> str:
+    """本文のうち、最初に一致した語の前後の文字列を返す（一致した語を[]で囲む）"""
+
+    for term in terms:
+        index = body.lower().find(term.lower())  # trigramの検索は大文字と小文字を区別しない
+        if index < 0:
+            continue
+        start = max(0, index - SNIPPET_CHARS)
+        end = index + len(term) + SNIPPET_CHARS
+        snippet = body[start:index] + f"[{term}]" + body[index + len(term):end]
+        return " ".join(snippet.split())  # 改行をまとめて1行にする
+    return ""
@@ -0,0 +1,268 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import http.client
+from pathlib import Path
+import re
+import threading
+from time import perf_counter
+import urllib.request
+from urllib.parse import urlsplit
+
+from selenium.webdriver.chrome.webdriver import WebDriver
+
+from settings import SEGMENTED_DOWNLOAD
+
+# 1回の読み込みで受け取るバイト数
+CHUNK_SIZE = 1024 * 1024
+# HTTPの接続と読み込みのタイムアウト（秒）
+HTTP_TIMEOUT = 30
+
+content_range_regex = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+class _CookieSafeRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """別のホストにリダイレクトされる場合に、manabaのCookieを送らないようにするハンドラー"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new_request = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new_request is not None and urlsplit(newurl).netloc != urlsplit(req.full_url).netloc:
+            new_request.remove_header("Cookie")
+        return new_request
+
+
+_opener = urllib.request.build_opener(_CookieSafeRedirectHandler)
+
+
+@dataclass(frozen=True, slots=True)
+class RangeSupport:
+    """ファイルのURLが区間（Range）を指定したダウンロードに対応しているかを表すデータクラス"""
+
+    url: str  # リダイレクト後のURL
+    size: int  # ファイルサイズ（バイト）
+    is_same_host: bool  # リダイレクト後のホストが元のURLと同じ場合はTrue（Cookieを送るかどうかに使う）
+    validator: str  # ファイルの版を表すETagまたはLast-Modified（ない場合は空文字）
+
+
+class SegmentedDownloader:
+    """大きなファイルを複数の区間に分け、複数の接続で並行にダウンロードするクラス
+
+    ブラウザのCookieを使ってHTTPで直接ダウンロードし、区間ごとに失敗したものだけを再試行する
+
+    Attributes:
+        threshold (int): 分割してダウンロードするファイルサイズの下限（バイト）
+        segment_count (int): 分割する区間の数（同時に使う接続の数）
+        max_retries (int): 1つの区間を再試行する最大回数
+
+    Note:
+        サーバーが区間の指定に対応していない場合や、ファイルが小さい場合は分割せず、ブラウザで1本の接続でダウンロードする
+        segment_count個のスレッドがそれぞれ接続を保持し、複数のファイルの区間で使い回す
+        使い終わったらcloseを呼ぶか、withブロックで使うこと
+    """
+
+    __slots__ = ("threshold", "segment_count", "max_retries",
+                 "_cookie_header", "_user_agent", "_probes", "_local", "_executor")
+
+    def __init__(self, cookies: list[dict], user_agent: str, threshold_mb: float = SEGMENTED_DOWNLOAD["threshold_mb"],
+                 segment_count: int = SEGMENTED_DOWNLOAD["segment_count"], max_retries: int = SEGMENTED_DOWNLOAD["max_retries"]):
+        self.threshold = int(threshold_mb * 1024 * 1024)
+        self.segment_count = max(1, segment_count)
+        self.max_retries = max_retries
+        self._cookie_header = "; ".join(
+            f"{cookie['name']}={cookie['value']}" for cookie in cookies)
+        self._user_agent = user_agent
+        self._probes = {}  # URLとRangeSupport（対応していない場合はNone）
+        self._local = threading.local()  # スレッドごとの接続
+        self._executor = ThreadPoolExecutor(max_workers=self.segment_count)
+
+    def __enter__(self) -> SegmentedDownloader:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """区間をダウンロードするスレッドを終了する"""
+
+        self._executor.shutdown()
+
+    @classmethod
+    def from_driver(cls, driver: WebDriver) -> SegmentedDownloader:
+        """ブラウザのCookieとユーザーエージェントを引き継いだ自身のインスタンスを生成する
+
+        Args:
+            driver (WebDriver): manabaにログイン済みのブラウザを操作するドライバー（Selenium）
+
+        Returns:
+            SegmentedDownloader: 生成した自身のインスタンス
+        """
+
+        return cls(driver.get_cookies(), driver.execute_script("return navigator.userAgent;"))
+
+    def probe(self, url: str) -> RangeSupport:
+        """引数のURLのファイルを分割してダウンロードできるかを調べる（結果はURLごとに保持する）
+
+        Args:
+            url (str): ファイルのURL
+
+        Returns:
+            RangeSupport: 分割してダウンロードできる場合はその情報、できない場合（小さいファイルを含む）はNone
+        """
+
+        if url in self._probes:
+            return self._probes[url]
+
+        # 先頭の1バイトだけを要求し、206が返ってくれば区間の指定に対応している
+        request = urllib.request.Request(
+            url, headers=self._headers(True) | {"Range": "bytes=0-0"})
+        try:
+            with _opener.open(request, timeout=HTTP_TIMEOUT) as response:
+                m = re.fullmatch(content_range_regex,
+                                 response.headers.get("Content-Range", ""))
+                if response.status != 206 or m is None:
+                    support = None
+                else:
+                    final_url = response.geturl()
+                    size = int(m.group(3))
+                    is_same_host = urlsplit(
+                        final_url).netloc == urlsplit(url).netloc
+                    # 弱いETag（W/から始まる）はIf-Rangeに使えないので、その場合はLast-Modifiedを使う
+                    etag = response.headers.get("ETag", "")
+                    validator = etag if etag and not etag.startswith("W/") \
+                        else response.headers.get("Last-Modified", "")
+                    support = RangeSupport(final_url, size, is_same_host, validator) \
+                        if size >= self.threshold else None
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Failed to check range support of {url}: {e}")
+            support = None
+
+        self._probes[url] = support
+        return support
+
+    def fetch_headers(self, url: str) -> dict[str, str]:
+        """引数のURLのファイルのレスポンスヘッダーを取得する（本文は先頭の1バイトだけを受け取る）
+
+        Args:
+            url (str): ファイルのURL
+
+        Returns:
+            dict[str, str]: レスポンスヘッダー（区間の指定に対応している場合も、Content-Lengthはファイル全体の大きさ）
+
+        Note:
+            接続に失敗した場合はOSErrorを送出する
+        """
+
+        request = urllib.request.Request(
+            url, headers=self._headers(True) | {"Range": "bytes=0-0"})
+        with _opener.open(request, timeout=HTTP_TIMEOUT) as response:
+            headers = dict(response.headers)
+            m = re.fullmatch(content_range_regex,
+                             headers.get("Content-Range", ""))
+            if response.status == 206 and m is not None:
+                headers["Content-Length"] = m.group(3)
+        return headers
+
+    def download(self, url: str, dest_path: Path) -> bool:
+        """引数のURLのファイルを分割してダウンロードし、dest_pathに保存する
+
+        Args:
+            url (str): ファイルのURL
+            dest_path (Path): 保存先のファイルパス
+
+        Returns:
+            bool: 分割してダウンロードできた場合はTrue、分割できない場合や失敗した場合はFalse
+        """
+
+        support = self.probe(url)
+        if support is None:
+            return False
+
+        # 区間に分け、ファイルサイズ分の領域を確保した一時ファイルに書き込む
+        segment_size = -(-support.size // self.segment_count)  # 切り上げ
+        segments = [(start, min(start + segment_size, support.size) - 1)
+                    for start in range(0, support.size, segment_size)]
+        part_path = dest_path.with_name(dest_path.name + ".part")
+        with open(part_path, "wb") as f:
+            f.truncate(support.size)
+
+        started_at = perf_counter()
+        received_sizes = list(self._executor.map(
+            lambda segment: self._download_segment(support, part_path, *segment), segments))
+        elapsed = perf_counter() - started_at
+
+        # 全ての区間を受け取り、受け取ったバイト数の合計がファイルサイズと一致する場合だけ保存先に移動する
+        if 0 in received_sizes or sum(received_sizes) != support.size:
+            print(f"Failed to download {url} in {len(segments)} segments")
+            part_path.unlink(missing_ok=True)
+            return False
+        part_path.replace(dest_path)
+
+        size_mb = support.size / 1024 / 1024
+        print(f"Downloaded '{dest_path.name}' ({size_mb:.1f} MB) in {len(segments)} segments "
+              f"in {elapsed:.1f}s ({size_mb / max(elapsed, 1e-9):.1f} MB/s)")
+        return True
+
+    def _download_segment(self, support: RangeSupport, part_path: Path, start: int, end: int) -> int:
+        """1つの区間をダウンロードして、一時ファイルの該当する位置に書き込む（失敗した場合は再試行する）
+
+        Returns:
+            int: 受け取ったバイト数（失敗した場合は0）
+
+        Note:
+            If-Rangeを付けて要求するので、調べた後にファイルが差し替えられた場合は206が返らずに失敗する（異なる版の区間が混ざらない）
+        """
+
+        split_url = urlsplit(support.url)
+        path = split_url.path + (f"?{split_url.query}" if split_url.query else "")
+        headers = self._headers(support.is_same_host) | {
+            "Range": f"bytes={start}-{end}"}
+        if support.validator:
+            headers["If-Range"] = support.validator
+
+        for _ in range(self.max_retries + 1):
+            connection = self._connection(split_url.scheme, split_url.netloc)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                if response.status != 206 or response.getheader("Content-Range", "").split("/")[0] != f"bytes {start}-{end}":
+                    response.read()
+                    raise OSError(
+                        f"unexpected response {response.status} for bytes {start}-{end}")
+
+                # 受け取ったバイト数が区間の長さと一致するかを確かめる
+                received = 0
+                with open(part_path, "r+b") as f:
+                    f.seek(start)
+                    while chunk := response.read(CHUNK_SIZE):
+                        f.write(chunk)
+                        received += len(chunk)
+                if received == end - start + 1:
+                    return received
+                raise OSError(
+                    f"received {received} bytes for bytes {start}-{end}")
+            except (OSError, http.client.HTTPException) as e:
+                print(f"Retrying bytes {start}-{end} of {support.url}: {e}")
+                connection.close()
+                self._local.connections.pop(
+                    (split_url.scheme, split_url.netloc), None)
+        return 0
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        """このスレッドが保持する接続を返す（ない場合は作成する）"""
+
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        key = (scheme, netloc)
+        if key not in self._local.connections:
+            connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            self._local.connections[key] = connection_class(
+                netloc, timeout=HTTP_TIMEOUT)
+        return self._local.connections[key]
+
+    def _headers(self, is_same_host: bool) -> dict[str, str]:
+        """リクエストヘッダーを返す（Cookieは元のURLと同じホストにだけ送る）"""
+
+        headers = {"User-Agent": self._user_agent}
+        if is_same_host and self._cookie_header:
+            headers["Cookie"] = self._cookie_header
+        return headers
@@ -0,0 +1,294 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, asdict
+import gzip
+import json
+from pathlib import Path
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.chrome.webdriver import WebDriver
+from selenium.webdriver.common.by import By
+
+from .segmented_download import SegmentedDownloader
+from settings import RECORD_SCRUB_WORDS, RECORD_SCRUB_SELECTORS
+
+# 個人情報を置き換える文字列
+SCRUBBED = "***"
+# 添付ファイルについて記録するレスポンスヘッダー
+ATTACHMENT_HEADERS = ("Content-Type", "Content-Length",
+                      "Content-Disposition", "Last-Modified", "ETag")
+
+
+@dataclass(slots=True)
+class SessionArchive:
+    """実際の実行中に開いたページと添付ファイルのレスポンスヘッダーを保存するデータクラス
+
+    gzipで圧縮したJSONファイルとして保存し、ReplayDriverでネットワークやブラウザなしに再生する
+
+    Note:
+        RecordingDriverで記録されることを想定
+    """
+
+    pages: dict[str, str] = field(default_factory=dict)  # URLとページのソース
+    # 開いたがページのソースを読まなかったURL（添付ファイルのリンク）と、そのレスポンスヘッダー（取得できなかった場合は空の辞書）
+    attachments: dict[str, dict[str, str]] = field(default_factory=dict)
+
+    @classmethod
+    def from_file(cls, archive_path: Path) -> SessionArchive:
+        """圧縮したJSONファイルから自身のインスタンスを生成する
+
+        Args:
+            archive_path (Path): アーカイブのファイルパス
+
+        Returns:
+            SessionArchive: 生成した自身のインスタンス
+        """
+
+        with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def to_file(self, archive_path: Path) -> None:
+        """圧縮したJSONファイルに書き込む（上書き）
+
+        Args:
+            archive_path (Path): 書き込み先のファイルパス
+        """
+
+        with gzip.open(archive_path, "wt", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False)
+
+
+def scrub(text: str) -> str:
+    """文字列から、設定ファイルで指定された個人情報（氏名や学籍番号など）を取り除く
+
+    Args:
+        text (str): ページのソースやURL
+
+    Returns:
+        str: 個人情報を置き換えた文字列
+    """
+
+    for word in RECORD_SCRUB_WORDS:
+        text = text.replace(word, SCRUBBED)
+    return text
+
+
+def scrub_html(html: str) -> str:
+    """ページのソースから、スクリプト、フォームの隠し値（セッションのトークンなど）と個人情報を取り除く
+
+    Args:
+        html (str): ページのソース
+
+    Returns:
+        str: 個人情報を取り除いたページのソース
+    """
+
+    soup = BeautifulSoup(html, "html.parser")
+    for script in soup.find_all("script"):
+        script.decompose()
+    for hidden_input in soup.find_all("input", type="hidden"):
+        hidden_input["value"] = SCRUBBED
+    for selector in RECORD_SCRUB_SELECTORS:
+        for element in soup.select(selector):
+            element.string = SCRUBBED
+    return scrub(str(soup))
+
+
+class RecordingDriver:
+    """WebDriverを包み、開いたページのソースをSessionArchiveに記録するクラス
+
+    記録以外の操作は全て包んだWebDriverに委ねる
+
+    Attributes:
+        driver (WebDriver): 包むドライバー（Selenium）
+        archive (SessionArchive): 記録先のアーカイブ
+
+    Note:
+        ページのソースは個人情報を取り除いてから記録する
+        RECORD_SCRUB_WORDSとRECORD_SCRUB_SELECTORSが両方とも空の場合は、氏名などがページに残るので記録しない（ValueErrorを送出する）
+    """
+
+    __slots__ = ("driver", "archive", "_requested", "_visited_urls")
+
+    def __init__(self, driver: WebDriver, archive: SessionArchive = None):
+        if not RECORD_SCRUB_WORDS and not RECORD_SCRUB_SELECTORS:
+            raise ValueError("'record_scrub_words' and 'record_scrub_selectors' are both empty, "
+                             "so names and student IDs on the pages would be recorded as they are")
+        self.driver = driver
+        self.archive = archive or SessionArchive()
+        self._requested = None  # 最後に開いたURLと、開いた後の現在のURL
+        self._visited_urls = []
+
+    def __getattr__(self, name: str):
+        return getattr(self.driver, name)
+
+    def get(self, url: str) -> None:
+        previous_url = self.driver.current_url
+        self.driver.get(url)
+        self._visited_urls.append(url)
+
+        # ダウンロードのようにページが移動しなかった場合は、開いたURLと今のページを対応付けない
+        landed_url = self.driver.current_url
+        if landed_url != previous_url or landed_url == url:
+            self._requested = (url, landed_url)
+        else:
+            self._requested = None
+
+    @property
+    def page_source(self) -> str:
+        html = self.driver.page_source
+        self._record(html)
+        return html
+
+    def find_element(self, by: str, value: str):
+        self._record(self.driver.page_source)
+        return self.driver.find_element(by, value)
+
+    def find_elements(self, by: str, value: str):
+        self._record(self.driver.page_source)
+        return self.driver.find_elements(by, value)
+
+    def save(self, archive_path: Path) -> None:
+        """記録したアーカイブをファイルに書き込む
+
+        Args:
+            archive_path (Path): 書き込み先のファイルパス
+
+        Note:
+            ブラウザでのダウンロードではレスポンスヘッダーを読めないので、添付ファイルのURLにブラウザのCookieで改めて要求し、ヘッダーを記録する
+        """
+
+        attachment_urls = sorted({url for url in self._visited_urls
+                                  if scrub(url) not in self.archive.pages})
+        with SegmentedDownloader.from_driver(self.driver) as client:
+            self.archive.attachments = {scrub(url): self._fetch_headers(client, url)
+                                        for url in attachment_urls}
+        self.archive.to_file(archive_path)
+        print(
+            f"Recorded {len(self.archive.pages)} pages and {len(self.archive.attachments)} attachments to {archive_path}")
+
+    @staticmethod
+    def _fetch_headers(client: SegmentedDownloader, url: str) -> dict[str, str]:
+        """添付ファイルのレスポンスヘッダーのうち、ATTACHMENT_HEADERSにあるものを取得する（個人情報は取り除く）"""
+
+        try:
+            headers = client.fetch_headers(url)
+        except OSError as e:
+            print(f"Failed to record headers of {scrub(url)}: {e}")
+            return {}
+        return {name: scrub(headers[name]) for name in ATTACHMENT_HEADERS if name in headers}
+
+    def _record(self, html: str) -> None:
+        """今開いているページのソースを、開いたURLと現在のURLの両方で記録する（リダイレクトに対応するため）"""
+
+        scrubbed_html = scrub_html(html)
+        current_url = self.driver.current_url
+        urls = {current_url}
+        # 別のタブに切り替えている場合は、現在のURLが開いたURLと異なるので対応付けない
+        if self._requested is not None and self._requested[1] == current_url:
+            urls.add(self._requested[0])
+        for url in urls:
+            self.archive.pages[scrub(url)] = scrubbed_html
+
+
+class _ReplayElement:
+    """ReplayDriverが返す要素（SeleniumのWebElementのうち、このプログラムで使う操作だけをもつ）"""
+
+    __slots__ = ("tag", "base_url")
+
+    def __init__(self, tag, base_url: str):
+        self.tag = tag
+        self.base_url = base_url
+
+    @property
+    def text(self) -> str:
+        return self.tag.get_text()
+
+    def find_element(self, by: str, value: str) -> _ReplayElement:
+        elements = self.find_elements(by, value)
+        if elements == []:
+            raise NoSuchElementException(f"{by}={value}")
+        return elements[0]
+
+    def find_elements(self, by: str, value: str) -> list[_ReplayElement]:
+        match by:
+            case By.CSS_SELECTOR:
+                tags = self.tag.select(value)
+            case By.TAG_NAME:
+                tags = self.tag.find_all(value)
+            case _:
+                raise NotImplementedError(f"Replay does not support {by}")
+        return [_ReplayElement(tag, self.base_url) for tag in tags]
+
+    def get_attribute(self, name: str) -> str:
+        value = self.tag.get(name)
+        # Seleniumと同じく、リンクは絶対URLにして返す
+        if name in ("href", "src") and value is not None:
+            return urljoin(self.base_url, value)
+        return value
+
+    def click(self) -> None:
+        pass
+
+
+class ReplayDriver:
+    """SessionArchiveに記録したページを、WebDriverの代わりに返すクラス
+
+    ネットワークやブラウザなしに、CourseListやDownloadContentの解析処理を実行できる
+
+    Attributes:
+        archive (SessionArchive): 再生するアーカイブ
+        downloaded_links (list[str]): ダウンロードしようとした添付ファイルのリンク
+
+    Note:
+        記録されていないURLを開いた場合はKeyErrorを送出する
+        添付ファイルのリンクを開いた場合は、ファイルを保存せずにリンクだけを記録する
+    """
+
+    __slots__ = ("archive", "downloaded_links", "current_url", "_soup")
+
+    page_settle_seconds = 0  # ページの描画を待たない（utils.wait_page_loadedで使う）
+
+    def __init__(self, archive: SessionArchive):
+        self.archive = archive
+        self.downloaded_links = []
+        self.current_url = None
+        self._soup = None
+
+    def get(self, url: str) -> None:
+        url = scrub(url)
+        if url in self.archive.pages:
+            self.current_url = url
+            self._soup = None
+        elif url in self.archive.attachments:
+            self.downloaded_links.append(url)
+        else:
+            raise KeyError(f"'{url}' is not recorded in the archive")
+
+    @property
+    def page_source(self) -> str:
+        return self.archive.pages[self.current_url]
+
+    def find_element(self, by: str, value: str) -> _ReplayElement:
+        return self._root().find_element(by, value)
+
+    def find_elements(self, by: str, value: str) -> list[_ReplayElement]:
+        return self._root().find_elements(by, value)
+
+    def execute_cdp_cmd(self, cmd: str, cmd_args: dict) -> dict:
+        return {}
+
+    def implicitly_wait(self, time_to_wait: float) -> None:
+        pass
+
+    def set_page_load_timeout(self, time_to_wait: float) -> None:
+        pass
+
+    def quit(self) -> None:
+        pass
+
+    def _root(self) -> _ReplayElement:
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.page_source, "html.parser")
+        return _ReplayElement(self._soup, self.current_url)
@@ -0,0 +1,189 @@
+from __future__ import annotations
+from dataclasses import asdict
+import threading
+from time import sleep
+import traceback
+
+from selenium.webdriver.chrome.webdriver import WebDriver
+
+from .content import Content
+from .course import Course
+from .course_list import CourseList
+from .download_content import DownloadContent
+from .download_content_list import DownloadContentList
+from .file_history import FileHistory
+from .file_metadata import FileMetadata
+from .work_queue import WorkItem, WorkQueue
+from settings import FILE_HISTORY_JSON_PATH
+
+# 作業がないときに作業キューを確認する間隔（秒）
+POLL_SECONDS = 2
+
+
+class ShardCoordinator:
+    """講義の一覧から最初の作業を作業キューに追加し、完了した結果をファイルの履歴にまとめるクラス
+
+    Attributes:
+        queue (WorkQueue): 複数のマシンのワーカーで共有する作業キュー
+    """
+
+    __slots__ = ("queue")
+
+    def __init__(self, queue: WorkQueue):
+        self.queue = queue
+
+    def enqueue(self, course_list: CourseList, download_content_list: DownloadContentList) -> None:
+        """ダウンロードするコンテンツごとに、講義の作業を追加して作業キューに封をする
+
+        Args:
+            course_list (CourseList): CourseList.from_manabaで取得した講義の一覧
+            download_content_list (DownloadContentList): ダウンロードするコンテンツの名前の一覧
+
+        Note:
+            前回の実行の結果をファイルの履歴にまとめてから、完了した作業を削除して封を解く（同じ作業キューのファイルを毎回使える）
+        """
+
+        self.collect()
+        self.queue.reset()
+        for download_content in download_content_list.content_name_list:
+            course = course_list.search_course(download_content.course_name)
+            if course is None:
+                continue
+            self.queue.put("course", f"course:{course.link}:{download_content.content_name}",
+                           {"course": asdict(course), "download_content": asdict(download_content)})
+        self.queue.seal()
+
+    def wait(self) -> None:
+        """全ての作業が終わるまで待つ（進み具合を表示する）"""
+
+        while not self.queue.is_drained():
+            print(f"Waiting for workers: {self.queue.counts()}")
+            sleep(POLL_SECONDS * 5)
+        print(f"All work items are finished: {self.queue.counts()}")
+
+    def collect(self) -> None:
+        """完了した添付ファイルの作業の結果をファイルの履歴に加え、JSONファイルに書き込む
+
+        Note:
+            同じリンクとパスのファイルがすでに履歴にある場合は加えない（何度呼び出してもよい）
+            ドライランのワーカーの結果（ダウンロードしていないファイル）は加えない
+        """
+
+        file_history = FileHistory.from_json(FILE_HISTORY_JSON_PATH)
+        recorded = {(file_metadata.link, file_metadata.path)
+                    for file_metadata in file_history.file_history}
+        dry_run_count = 0
+        for result in self.queue.results("attachment"):
+            if result.pop("is_dry_run", False):
+                dry_run_count += 1
+                continue
+            file_metadata = FileMetadata(**result)
+            if (file_metadata.link, file_metadata.path) not in recorded:
+                file_history.add(file_metadata)
+        file_history.to_json(FILE_HISTORY_JSON_PATH)
+        if dry_run_count > 0:
+            print(f"Skipped {dry_run_count} dry-run results")
+
+
+class ShardWorker:
+    """作業キューから作業を取り出して処理するクラス
+
+    作業の種類ごとに、次の作業を作業キューに追加する（course → content → page → attachment）
+
+    Attributes:
+        queue (WorkQueue): 複数のマシンのワーカーで共有する作業キュー
+        driver (WebDriver): このワーカーのブラウザを操作するドライバー（SeleniumまたはReplayDriver）
+        name (str): ワーカーの名前（リースの所有者として使う）
+        is_dry_run (bool): Trueの場合は添付ファイルをダウンロードせずに、メタデータだけを結果とする（結果に印を付け、ファイルの履歴には加えない）
+
+    Note:
+        未読のページは開くと既読になるため、ページごとに作業を分けて、途中で停止しても再試行できるようにする
+    """
+
+    __slots__ = ("queue", "driver", "name", "is_dry_run")
+
+    def __init__(self, queue: WorkQueue, driver: WebDriver, name: str, is_dry_run: bool = False):
+        self.queue = queue
+        self.driver = driver
+        self.name = name
+        self.is_dry_run = is_dry_run
+
+    def run(self) -> None:
+        """作業キューに封がされ、全ての作業が終わるまで作業を処理する"""
+
+        while True:
+            item = self.queue.claim(self.name)
+            if item is None:
+                if self.queue.is_drained():
+                    return
+                sleep(POLL_SECONDS)  # 他のワーカーが作業を追加する可能性があるので待つ
+                continue
+
+            # 作業中は別のスレッドで定期的にリースを延長する
+            stop = threading.Event()
+            heartbeat = threading.Thread(
+                target=self._heartbeat, args=(item, stop), daemon=True)
+            heartbeat.start()
+            try:
+                result = self._handle(item)
+            except Exception:
+                print(f"Failed {item.kind} item {item.id} in {self.name}")
+                print(traceback.format_exc())
+                self.queue.fail(item, self.name, traceback.format_exc())
+            else:
+                if not self.queue.complete(item, self.name, result):
+                    print(
+                        f"Lease of {item.kind} item {item.id} was lost by {self.name}")
+            finally:
+                stop.set()
+                heartbeat.join()
+
+    def _heartbeat(self, item: WorkItem, stop: threading.Event) -> None:
+        """リースの期間の3分の1ごとにリースを延長する（延長できなくなったら終了する）"""
+
+        while not stop.wait(self.queue.lease_seconds / 3):
+            if not self.queue.heartbeat(item, self.name):
+                return
+
+    def _handle(self, item: WorkItem) -> object:
+        """作業の種類に応じた処理を行い、結果を返す"""
+
+        download_content = DownloadContent(
+            **item.payload["download_content"]) if "download_content" in item.payload else None
+
+        match item.kind:
+            case "course":
+                course = Course(**item.payload["course"])
+                content = course.search_content(
+                    download_content.content_name, self.driver)
+                if content is None:
+                    return None
+                self.queue.put("content", f"content:{content.link}",
+                               {"download_content": asdict(download_content), "content": asdict(content)})
+                return asdict(content)
+
+            case "content":
+                content = Content(**item.payload["content"])
+                links = download_content.find_unread_links(
+                    self.driver, content)
+                for link in links:
+                    self.queue.put("page", f"page:{link}",
+                                   {"download_content": asdict(download_content), "link": link})
+                return links
+
+            case "page":
+                file_metadata_list = download_content.fetch_attachments(
+                    self.driver, item.payload["link"])
+                for file_metadata in file_metadata_list:
+                    self.queue.put(
+                        "attachment", f"attachment:{file_metadata.link}", asdict(file_metadata))
+                return len(file_metadata_list)
+
+            case "attachment":
+                file_metadata = FileMetadata(**item.payload)
+                if not self.is_dry_run:
+                    file_metadata.download_by(self.driver)
+                return asdict(file_metadata) | {"is_dry_run": self.is_dry_run}
+
+            case _:
+                raise ValueError(f"Unknown work item kind '{item.kind}'")
@@ -0,0 +1,229 @@
+from __future__ import annotations
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import sqlite3
+from time import time
+
+from settings import SHARD_LEASE_SECONDS, SHARD_MAX_ATTEMPTS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_expires);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class WorkItem:
+    """作業キューから取り出した1つの作業を表すデータクラス"""
+
+    id: int
+    kind: str  # course、content、page、attachmentのいずれか
+    payload: dict
+    attempts: int  # この作業を取り出した回数（今回を含む）
+
+
+class WorkQueue:
+    """複数のマシンのワーカーで共有する作業キュー（SQLiteのファイル）を扱うクラス
+
+    ワーカーは作業をリース（期限付きの貸し出し）で取り出し、作業中は定期的にリースを延長する
+    リースが切れた作業（ワーカーが停止した場合など）は、他のワーカーが取り出し直す
+
+    Attributes:
+        db_path (Path): 作業キューのファイルパス（共有ストレージに置く）
+        lease_seconds (float): リースの期間（秒）
+        max_attempts (int): 1つの作業を取り出す最大回数（超えた作業は失敗とする）
+
+    Note:
+        ネットワークファイルシステムでも動くように、WALではなく通常のジャーナルで排他制御する
+        操作ごとに接続を開くので、複数のスレッドやプロセスから同時に使える
+        リースの期限は各マシンの時刻で判定するため、マシン間の時刻を同期しておくこと
+    """
+
+    __slots__ = ("db_path", "lease_seconds", "max_attempts")
+
+    def __init__(self, db_path: Path, lease_seconds: float = SHARD_LEASE_SECONDS, max_attempts: int = SHARD_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with closing(self._connect()) as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self, is_write: bool = True):
+        """トランザクションを開始する（例外が発生した場合はロールバックする）
+
+        Args:
+            is_write (bool, optional): Trueの場合は、開始時に書き込みのロックを取得する
+        """
+
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE" if is_write else "BEGIN")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def put(self, kind: str, key: str, payload: dict) -> bool:
+        """作業を追加する（同じキーの作業がすでにある場合は追加しない）
+
+        Args:
+            kind (str): 作業の種類
+            key (str): 作業を一意に表すキー
+            payload (dict): 作業の内容（JSONに変換できるもの）
+
+        Returns:
+            bool: 追加した場合はTrue
+        """
+
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO items (key, kind, payload) VALUES (?, ?, ?)",
+                (key, kind, json.dumps(payload, ensure_ascii=False)))
+            return cursor.rowcount == 1
+
+    def claim(self, owner: str) -> WorkItem:
+        """未処理の作業、またはリースが切れた作業を1つ取り出す
+
+        Args:
+            owner (str): 取り出すワーカーの名前
+
+        Returns:
+            WorkItem: 取り出した作業（取り出せる作業がない場合はNone）
+        """
+
+        now = time()
+        with self._transaction() as connection:
+            # リースが切れたまま取り出し回数の上限に達した作業は失敗とする
+            connection.execute(
+                "UPDATE items SET state = 'failed', owner = NULL, error = COALESCE(error, 'lease expired') "
+                "WHERE state = 'claimed' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts))
+            row = connection.execute(
+                "SELECT id, kind, payload, attempts FROM items "
+                "WHERE state = 'pending' OR (state = 'claimed' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            item_id, kind, payload, attempts = row
+            connection.execute(
+                "UPDATE items SET state = 'claimed', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (owner, now + self.lease_seconds, item_id))
+        return WorkItem(item_id, kind, json.loads(payload), attempts + 1)
+
+    def heartbeat(self, item: WorkItem, owner: str) -> bool:
+        """作業のリースを延長する
+
+        Args:
+            item (WorkItem): 作業中の作業
+            owner (str): 作業中のワーカーの名前
+
+        Returns:
+            bool: 延長できた場合はTrue（リースが切れて他のワーカーに取り出された場合はFalse）
+        """
+
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE items SET lease_expires = ? WHERE id = ? AND owner = ? AND state = 'claimed'",
+                (time() + self.lease_seconds, item.id, owner))
+            return cursor.rowcount == 1
+
+    def complete(self, item: WorkItem, owner: str, result: object = None) -> bool:
+        """作業を完了にして、結果を書き込む
+
+        Args:
+            item (WorkItem): 完了した作業
+            owner (str): 作業したワーカーの名前
+            result (object, optional): 作業の結果（JSONに変換できるもの）
+
+        Returns:
+            bool: 書き込めた場合はTrue（リースが切れて他のワーカーに取り出された場合はFalse）
+        """
+
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE items SET state = 'done', result = ?, error = NULL WHERE id = ? AND owner = ? AND state = 'claimed'",
+                (json.dumps(result, ensure_ascii=False), item.id, owner))
+            return cursor.rowcount == 1
+
+    def fail(self, item: WorkItem, owner: str, error: str) -> None:
+        """作業を失敗にする（取り出し回数が上限に達していない場合は、未処理に戻して再試行させる）
+
+        Args:
+            item (WorkItem): 失敗した作業
+            owner (str): 作業したワーカーの名前
+            error (str): エラーの内容
+        """
+
+        state = "failed" if item.attempts >= self.max_attempts else "pending"
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE items SET state = ?, owner = NULL, lease_expires = NULL, error = ? "
+                "WHERE id = ? AND owner = ? AND state = 'claimed'",
+                (state, error, item.id, owner))
+
+    def seal(self) -> None:
+        """コーディネーターが最初の作業を全て追加したことを記録する（ワーカーは封をされた後に作業がなくなったら終了する）"""
+
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('is_sealed', '1')")
+
+    def reset(self) -> None:
+        """完了した作業と失敗した作業を削除し、封を解く（同じ作業キューのファイルで次の実行を始めるため）
+
+        Note:
+            未処理の作業と作業中の作業は残す（前回の実行の作業は、次の実行で処理される）
+            作業のキーは実行をまたいで重複するため、削除しないと次の実行で同じ作業を追加できない
+        """
+
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM items WHERE state IN ('done', 'failed')")
+            connection.execute("DELETE FROM meta WHERE key = 'is_sealed'")
+
+    def is_drained(self) -> bool:
+        """封をされていて、未処理の作業も作業中の作業もない場合はTrueを返す"""
+
+        with self._transaction(is_write=False) as connection:
+            is_sealed = connection.execute(
+                "SELECT 1 FROM meta WHERE key = 'is_sealed'").fetchone() is not None
+            remaining = connection.execute(
+                "SELECT COUNT(*) FROM items WHERE state IN ('pending', 'claimed')").fetchone()[0]
+        return is_sealed and remaining == 0
+
+    def counts(self) -> dict[str, int]:
+        """状態ごとの作業の数を返す"""
+
+        with self._transaction(is_write=False) as connection:
+            return dict(connection.execute(
+                "SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+
+    def results(self, kind: str) -> list:
+        """引数の種類の完了した作業の結果を、追加した順に返す"""
+
+        with self._transaction(is_write=False) as connection:
+            rows = connection.execute(
+                "SELECT result FROM items WHERE kind = ? AND state = 'done' ORDER BY id", (kind,)).fetchall()
+        return [json.loads(result) for (result,) in rows]
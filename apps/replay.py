@@ -0,0 +1,74 @@
+# 記録したアーカイブを再生して、ダウンロードする予定のファイルを出力するプログラム（ネットワークやブラウザは使わない）
+# 解析処理の変更前後で出力を比較したり、実行時間を計測したりするために使う
+
+from __future__ import annotations
+import argparse
+from contextlib import redirect_stdout
+from dataclasses import asdict
+import io
+import json
+import statistics
+import sys
+from pathlib import Path
+from time import perf_counter
+
+# manaba_auto_downloaderディレクトリをモジュール検索パスに追加（そのディレクトリにあるsettings.pyがインポート可能になる）
+sys.path.append(str(Path(__file__).parents[1]))  # noqa: E402
+
+import modules
+from settings import DOWNLOAD_CONTENT_LIST_JSON_PATH
+
+
+def replay_plan(archive: modules.SessionArchive, download_content_list: modules.DownloadContentList) -> list[modules.FileMetadata]:
+    """アーカイブを再生し、講義の一覧の取得からダウンロードする予定のファイルの取得までを行う
+
+    Args:
+        archive (SessionArchive): 再生するアーカイブ
+        download_content_list (DownloadContentList): ダウンロードするコンテンツの名前の一覧
+
+    Returns:
+        list[FileMetadata]: ダウンロードする予定のファイルのメタデータ
+    """
+
+    driver = modules.ReplayDriver(archive)
+    course_list = modules.CourseList.from_manaba(driver)
+    return download_content_list.plan(driver, course_list)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded session archive and print the download plan")
+    parser.add_argument("archive", type=Path,
+                        help="session archive recorded with 'record_archive'")
+    parser.add_argument("--contents", type=Path, default=DOWNLOAD_CONTENT_LIST_JSON_PATH,
+                        help="download content list JSON (default: config/download_content_list.json)")
+    parser.add_argument("--output", type=Path,
+                        help="write the plan as JSON to this file instead of stdout")
+    parser.add_argument("--bench", type=int, default=0, metavar="N",
+                        help="replay N more times and report the parse and plan time")
+    args = parser.parse_args()
+
+    archive = modules.SessionArchive.from_file(args.archive)
+    download_content_list = modules.DownloadContentList.from_json(
+        args.contents)
+
+    plan = replay_plan(archive, download_content_list)
+    plan_json = json.dumps([asdict(file_metadata) for file_metadata in plan],
+                           ensure_ascii=False, indent=4)
+    if args.output:
+        args.output.write_text(plan_json, encoding="utf-8")
+    else:
+        print(plan_json)
+
+    if args.bench > 0:
+        times = []
+        for _ in range(args.bench):
+            # 計測中はページの解析に関するメッセージを表示しない
+            with redirect_stdout(io.StringIO()):
+                started_at = perf_counter()
+                replay_plan(archive, download_content_list)
+                times.append(perf_counter() - started_at)
+        print(f"Replayed {len(archive.pages)} pages {args.bench} times: "
+              f"min {min(times) * 1000:.1f} ms, median {statistics.median(times) * 1000:.1f} ms",
+              file=sys.stderr)
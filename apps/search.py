@@ -0,0 +1,60 @@
+# ダウンロードしたファイルの中身を全文検索するプログラム
+#
+# 例）
+#   python apps/search.py 固有値 --course 線形代数
+#   python apps/search.py --update   （索引を更新するだけ）
+
+from __future__ import annotations
+import argparse
+import sys
+from pathlib import Path
+from time import perf_counter
+
+# manaba_auto_downloaderディレクトリをモジュール検索パスに追加（そのディレクトリにあるsettings.pyがインポート可能になる）
+sys.path.append(str(Path(__file__).parents[1]))  # noqa: E402
+
+import modules
+from settings import FILE_HISTORY_JSON_PATH
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Search the text of downloaded files")
+    parser.add_argument("query", nargs="*",
+                        help="words to search for (all words must match)")
+    parser.add_argument("--course", help="only files of courses whose name contains this")
+    parser.add_argument("--page", help="only files on pages whose title contains this")
+    parser.add_argument("--since", help="only files uploaded on or after this date (ex: 2000-01-01)")
+    parser.add_argument("--until", help="only files uploaded on or before this date (ex: 2000-12-31)")
+    parser.add_argument("--limit", type=int, default=20,
+                        help="maximum number of results (default: 20)")
+    parser.add_argument("--update", action="store_true",
+                        help="add new files in file_history.json to the index before searching")
+    args = parser.parse_args()
+
+    search_index = modules.SearchIndex()
+    if args.update:
+        search_index.update(
+            modules.FileHistory.from_json(FILE_HISTORY_JSON_PATH))
+        if not args.query:
+            sys.exit()
+
+    query = " ".join(args.query)
+    facet_filters = {"course_name": args.course, "page_title": args.page,
+                     "since": args.since, "until": args.until}
+
+    started_at = perf_counter()
+    results = search_index.search(query, limit=args.limit, **facet_filters)
+    facets = search_index.facets(query, **facet_filters)
+    elapsed = perf_counter() - started_at
+
+    for result in results:
+        print(f"{result.name}  [{result.course_name} / {result.page_title} / {result.upload_date}]")
+        print(f"    {result.path}")
+        if result.snippet:
+            print(f"    {result.snippet}")
+
+    total = sum(facets.values())
+    print(f"{len(results)} of {total} files in {elapsed * 1000:.1f} ms")
+    for course_name, count in facets.items():
+        print(f"    {course_name}: {count}")
@@ -0,0 +1,81 @@
+# 講義資料のダウンロードを複数のマシンで分担するプログラム
+# コーディネーターが共有ストレージ上の作業キューに作業を追加し、各マシンのワーカーがそれを取り出して処理する
+#
+# 例）ローカルで記録したアーカイブを使って試す場合
+#   python apps/shard.py coordinator queue.db --replay output/session.json.gz
+#   python apps/shard.py worker queue.db --replay output/session.json.gz --dry-run  （複数起動する）
+#   python apps/shard.py collect queue.db
+
+from __future__ import annotations
+import argparse
+import os
+import socket
+import sys
+from pathlib import Path
+
+# manaba_auto_downloaderディレクトリをモジュール検索パスに追加（そのディレクトリにあるsettings.pyがインポート可能になる）
+sys.path.append(str(Path(__file__).parents[1]))  # noqa: E402
+
+import modules
+from common import utils
+from settings import USERDATA_DIR, SAVE_DIR, DOWNLOAD_CONTENT_LIST_JSON_PATH, COURSE_SCOPE
+
+
+def open_driver(replay_path: Path):
+    """ブラウザを起動する（replay_pathを指定した場合は、記録したアーカイブを再生するドライバーを返す）"""
+
+    if replay_path is not None:
+        return modules.ReplayDriver(modules.SessionArchive.from_file(replay_path))
+    return utils.launch_browser(userdata_dir=USERDATA_DIR, download_dir=SAVE_DIR)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Share the download work among several machines through a work queue file")
+    parser.add_argument("role", choices=["coordinator", "worker", "collect", "status"],
+                        help="coordinator: enqueue courses, worker: process work items, "
+                             "collect: merge finished attachments into file_history.json, status: show item counts")
+    parser.add_argument("queue", type=Path,
+                        help="work queue file on shared storage")
+    parser.add_argument("--replay", type=Path,
+                        help="use a recorded session archive instead of the browser")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="(worker) record attachments without downloading them")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}",
+                        help="(worker) worker name used as the lease owner")
+    parser.add_argument("--wait", action="store_true",
+                        help="(coordinator) wait until all items are finished and then collect")
+    args = parser.parse_args()
+
+    queue = modules.WorkQueue(args.queue)
+    coordinator = modules.ShardCoordinator(queue)
+
+    match args.role:
+        case "coordinator":
+            driver = open_driver(args.replay)
+            # 記録したアーカイブは記録した時点の講義を含むので、範囲で絞り込まない
+            scope = None if args.replay else modules.CourseScope.from_dict(
+                COURSE_SCOPE)
+            course_list = modules.CourseList.from_manaba(driver, scope)
+            driver.quit()
+            coordinator.enqueue(course_list, modules.DownloadContentList.from_json(
+                DOWNLOAD_CONTENT_LIST_JSON_PATH))
+            print(f"Enqueued courses: {queue.counts()}")
+            if args.wait:
+                coordinator.wait()
+                coordinator.collect()
+
+        case "worker":
+            driver = open_driver(args.replay)
+            try:
+                modules.ShardWorker(queue, driver, args.name,
+                                    args.dry_run).run()
+            finally:
+                driver.quit()
+
+        case "collect":
+            coordinator.collect()
+
+        case "status":
+            print(queue.counts())
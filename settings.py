@@ -37,5 +37,59 @@ COURSE_LIST_JSON_PATH = OUTPUT_DIR / "course_list.json"
 # ダウンロードするコンテンツ名の一覧が入るJSONファイルのパス
 DOWNLOAD_CONTENT_LIST_JSON_PATH = CONFIG_DIR / "download_content_list.json"
 
+# manabaにある添付ファイルの索引（照合モードで使う）が保存されるJSONファイルのパス
+RECONCILE_INDEX_JSON_PATH = OUTPUT_DIR / "reconcile_index.json"
+
 # 講義の一覧（COURSE_LIST_JSON_PATH）を更新するかしないか（True or False）
 IS_UPDATE_COURSE_LIST = settings["is_update_course_list"]
+
+# 取得する講義の範囲（year、semester、day、periodで絞り込む。yearとsemesterには"current"を指定可能）
+COURSE_SCOPE = settings.get("course_scope", {})
+
+# 未読のページだけでなく全てのページを開き、手元にないファイルと更新されたファイルをダウンロードするかどうか（照合モード）
+IS_RECONCILE_MODE = settings.get("is_reconcile_mode", False)
+
+# 添付ファイルを1つずつ順番にダウンロードするかどうか（デバッグ用、falseの場合はパイプラインで並行にダウンロードする）
+IS_SEQUENTIAL_DOWNLOAD = settings.get("is_sequential_download", False)
+# パイプラインの各ステージのワーカー数（downloadは、パイプラインを使わない場合も含めて、同時にダウンロードするファイル数の上限）
+PIPELINE_CONCURRENCY = {"resolve": 1, "discover": 1, "extract": 1, "download": 4, "record": 1} \
+    | settings.get("pipeline_concurrency", {})
+# パイプラインのステージ間のキューの最大長
+PIPELINE_QUEUE_SIZE = settings.get("pipeline_queue_size", 16)
+
+# 講義の開始が近い順にダウンロードするかどうか
+IS_PRIORITY_MODE = settings.get("is_priority_mode", False)
+# 各時限の開始時刻
+PERIOD_TIMES = {"1限": "09:00", "2限": "10:40", "3限": "13:00", "4限": "14:40", "5限": "16:20"} \
+    | settings.get("period_times", {})
+
+# 1ページにある添付ファイルをまとめて同時にダウンロードするかどうか
+IS_BATCH_DOWNLOAD = settings.get("is_batch_download", True)
+# 1つのファイルのダウンロードを待つ最大時間（秒）
+DOWNLOAD_TIMEOUT = settings.get("download_timeout", 60)
+
+# 次のページを先読みするタブ数（0の場合は先読みしない、最大4）
+PREFETCH_TAB_COUNT = settings.get("prefetch_tab_count", 0)
+
+# 実行中に開いたページを記録するアーカイブ（gzip圧縮のJSON）のパス（Noneの場合は記録しない）
+RECORD_ARCHIVE_PATH = OUTPUT_DIR / settings["record_archive"] \
+    if settings.get("record_archive") else None
+# 記録するページから取り除く文字列（氏名や学籍番号など）
+RECORD_SCRUB_WORDS = settings.get("record_scrub_words", [])
+# 記録するページで中身を取り除く要素のCSSセレクタ
+RECORD_SCRUB_SELECTORS = settings.get("record_scrub_selectors", [])
+
+# 大きなファイルを複数の区間に分けて並行にダウンロードする設定（サーバーが区間の指定に対応している場合のみ）
+SEGMENTED_DOWNLOAD = {"is_enabled": False, "threshold_mb": 50, "segment_count": 4, "max_retries": 3} \
+    | settings.get("segmented_download", {})
+
+# 複数のマシンで分担する場合の、作業のリースの期間（秒）
+SHARD_LEASE_SECONDS = settings.get("shard_lease_seconds", 120)
+# 複数のマシンで分担する場合の、1つの作業を再試行する最大回数
+SHARD_MAX_ATTEMPTS = settings.get("shard_max_attempts", 3)
+
+# ダウンロードしたファイルの中身の全文検索用の索引のファイルパス
+SEARCH_INDEX_PATH = OUTPUT_DIR / "search_index.db"
+# ダウンロードの後に全文検索用の索引を更新する設定（max_workersは文字を抽出するプロセス数で、nullの場合はCPUの数）
+SEARCH_INDEX = {"is_enabled": False, "max_workers": None} \
+    | settings.get("search_index", {})